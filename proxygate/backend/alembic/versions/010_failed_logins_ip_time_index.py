@@ -0,0 +1,26 @@
+"""Add composite (ip_address, attempt_time) index to failed_logins
+
+Revision ID: 010_failed_logins_ip_time_index
+Revises: 009_access_token_expiry
+Create Date: 2026-10-15
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '010_failed_logins_ip_time_index'
+down_revision = '009_access_token_expiry'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        'ix_failed_logins_ip_address_attempt_time',
+        'failed_logins',
+        ['ip_address', 'attempt_time']
+    )
+
+
+def downgrade():
+    op.drop_index('ix_failed_logins_ip_address_attempt_time', table_name='failed_logins')
@@ -0,0 +1,31 @@
+"""Replace blocked_ips.is_active index with a partial index on live blocks
+
+Revision ID: 011_blocked_ips_active_partial_index
+Revises: 010_failed_logins_ip_time_index
+Create Date: 2026-10-15
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '011_blocked_ips_active_partial_index'
+down_revision = '010_failed_logins_ip_time_index'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        'ix_blocked_ips_active_ip',
+        'blocked_ips',
+        ['ip_address'],
+        postgresql_where=sa.text('is_active'),
+        sqlite_where=sa.text('is_active')
+    )
+    op.drop_index('ix_blocked_ips_is_active', table_name='blocked_ips')
+
+
+def downgrade():
+    op.create_index('ix_blocked_ips_is_active', 'blocked_ips', ['is_active'])
+    op.drop_index('ix_blocked_ips_active_ip', table_name='blocked_ips')
@@ -0,0 +1,36 @@
+"""Server-side defaults for security timestamps
+
+Revision ID: 012_security_server_timestamps
+Revises: 011_blocked_ips_active_partial_index
+Create Date: 2026-10-15
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '012_security_server_timestamps'
+down_revision = '011_blocked_ips_active_partial_index'
+branch_labels = None
+depends_on = None
+
+_COLUMNS = [
+    ('failed_logins', 'attempt_time'),
+    ('blocked_ips', 'blocked_at'),
+    ('security_events', 'created_at'),
+]
+
+
+def upgrade():
+    for table, column in _COLUMNS:
+        op.alter_column(
+            table,
+            column,
+            existing_type=sa.DateTime(),
+            server_default=sa.text("TIMEZONE('utc', CURRENT_TIMESTAMP)")
+        )
+
+
+def downgrade():
+    for table, column in _COLUMNS:
+        op.alter_column(table, column, existing_type=sa.DateTime(), server_default=None)
@@ -0,0 +1,39 @@
+"""Notify blocked_ips changes so app workers can refresh their blocklist
+
+Revision ID: 013_blocked_ips_notify_trigger
+Revises: 012_security_server_timestamps
+Create Date: 2026-10-15
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '013_blocked_ips_notify_trigger'
+down_revision = '012_security_server_timestamps'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute("""
+        CREATE OR REPLACE FUNCTION notify_blocked_ips_changed() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('blocked_ips_changed', COALESCE(NEW.ip_address, OLD.ip_address));
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER blocked_ips_changed
+        AFTER INSERT OR UPDATE OR DELETE ON blocked_ips
+        FOR EACH ROW EXECUTE FUNCTION notify_blocked_ips_changed()
+    """)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute("DROP TRIGGER IF EXISTS blocked_ips_changed ON blocked_ips")
+    op.execute("DROP FUNCTION IF EXISTS notify_blocked_ips_changed()")
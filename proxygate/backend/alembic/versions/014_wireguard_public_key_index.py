@@ -0,0 +1,26 @@
+"""Index wireguard_configs.public_key for the traffic stats UPDATE
+
+Revision ID: 014_wireguard_public_key_index
+Revises: 013_blocked_ips_notify_trigger
+Create Date: 2026-10-15
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '014_wireguard_public_key_index'
+down_revision = '013_blocked_ips_notify_trigger'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        'ix_wireguard_configs_public_key',
+        'wireguard_configs',
+        ['public_key']
+    )
+
+
+def downgrade():
+    op.drop_index('ix_wireguard_configs_public_key', table_name='wireguard_configs')
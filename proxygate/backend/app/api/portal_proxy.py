@@ -42,8 +42,8 @@ async def get_ip_whitelist(
 
     client_ip = get_client_ip(request)
     allowed_ips = []
-    if client.proxy_account and client.proxy_account.allowed_ips:
-        allowed_ips = [ip.strip() for ip in client.proxy_account.allowed_ips.split(",") if ip.strip()]
+    if client.proxy_account:
+        allowed_ips = list(client.proxy_account.allowed_ip_list)
 
     return IpWhitelistResponse(
         client_ip=client_ip,
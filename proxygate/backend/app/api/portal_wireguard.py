@@ -62,7 +62,7 @@ async def get_wireguard_connection_info(
             }
         )
 
-    server_ip = wg_manager.get_server_ip()
+    server_ip = await wg_manager.get_server_ip_async()
 
     server_settings = WgServerSettings(
         private_key=server_config.private_key,
@@ -181,7 +181,7 @@ async def download_wireguard_config(
     if not server_config or not server_config.is_enabled:
         raise HTTPException(status_code=404, detail="WireGuard server not configured")
 
-    server_ip = wg_manager.get_server_ip()
+    server_ip = await wg_manager.get_server_ip_async()
 
     server_settings = WgServerSettings(
         private_key=server_config.private_key,
@@ -247,7 +247,7 @@ async def get_wireguard_qrcode(
     if not server_config or not server_config.is_enabled:
         raise HTTPException(status_code=404, detail="WireGuard server not configured")
 
-    server_ip = wg_manager.get_server_ip()
+    server_ip = await wg_manager.get_server_ip_async()
 
     server_settings = WgServerSettings(
         private_key=server_config.private_key,
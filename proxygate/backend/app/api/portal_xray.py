@@ -71,7 +71,7 @@ async def get_xray_connection_info(
             }
         )
 
-    server_ip = xray_manager.get_server_ip()
+    server_ip = await xray_manager.get_server_ip_async()
     short_id = xray_config.short_id or server_config.short_id
 
     server_settings = XrayServerSettings(
@@ -200,7 +200,7 @@ async def get_xray_qrcode(
     if not server_config or not server_config.is_enabled:
         raise HTTPException(status_code=404, detail="XRay server not configured")
 
-    server_ip = xray_manager.get_server_ip()
+    server_ip = await xray_manager.get_server_ip_async()
     server_settings = XrayServerSettings(
         port=server_config.port,
         private_key=server_config.private_key,
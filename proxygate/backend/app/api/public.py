@@ -698,9 +698,8 @@ async def client_connect_page(
     client_ip = get_client_ip(request)
     csrf_token = _generate_csrf_token(access_token)
     ip_already_whitelisted = False
-    if client.proxy_account and client.proxy_account.allowed_ips:
-        whitelisted = [ip.strip() for ip in client.proxy_account.allowed_ips.split(",") if ip.strip()]
-        ip_already_whitelisted = client_ip in whitelisted
+    if client.proxy_account:
+        ip_already_whitelisted = client_ip in client.proxy_account.allowed_ip_list
 
     # XRay data
     vless_url = None
@@ -710,7 +709,7 @@ async def client_connect_page(
         xray_srv = xray_srv_result.scalar_one_or_none()
         if xray_srv and xray_srv.is_enabled:
             xray_available = True
-            xray_domain = domain if domain and domain != "localhost" else xray_manager.get_server_ip()
+            xray_domain = domain if domain and domain != "localhost" else await xray_manager.get_server_ip_async()
             xray_settings = XrayServerSettings(
                 port=xray_srv.port, private_key=xray_srv.private_key,
                 public_key=xray_srv.public_key, short_id=xray_srv.short_id,
@@ -730,7 +729,7 @@ async def client_connect_page(
         wg_srv = wg_srv_result.scalar_one_or_none()
         if wg_srv and wg_srv.is_enabled:
             wg_available = True
-            wg_server_ip = wg_manager.get_server_ip()
+            wg_server_ip = await wg_manager.get_server_ip_async()
             wg_server_port = wg_srv.wstunnel_port if wg_srv.wstunnel_enabled else wg_srv.listen_port
             wg_client_ip = client.wireguard_config.assigned_ip
 
@@ -837,7 +836,7 @@ async def public_xray_qr(access_token: str, db: DBSession):
     if not xray_srv or not xray_srv.is_enabled:
         raise HTTPException(status_code=404, detail="XRay server not configured")
 
-    xray_domain = get_configured_domain() or xray_manager.get_server_ip()
+    xray_domain = get_configured_domain() or await xray_manager.get_server_ip_async()
     xray_settings = XrayServerSettings(
         port=xray_srv.port, private_key=xray_srv.private_key,
         public_key=xray_srv.public_key, short_id=xray_srv.short_id,
@@ -877,7 +876,7 @@ async def public_wg_qr(access_token: str, db: DBSession):
     if not wg_srv or not wg_srv.is_enabled:
         raise HTTPException(status_code=404, detail="WireGuard not configured")
 
-    server_ip = wg_manager.get_server_ip()
+    server_ip = await wg_manager.get_server_ip_async()
     wg_settings = WgServerSettings(
         private_key=wg_srv.private_key, public_key=wg_srv.public_key,
         interface=wg_srv.interface, listen_port=wg_srv.listen_port,
@@ -913,7 +912,7 @@ async def public_wg_conf_download(access_token: str, db: DBSession):
     if not wg_srv or not wg_srv.is_enabled:
         raise HTTPException(status_code=404, detail="WireGuard not configured")
 
-    server_ip = wg_manager.get_server_ip()
+    server_ip = await wg_manager.get_server_ip_async()
     wg_settings = WgServerSettings(
         private_key=wg_srv.private_key, public_key=wg_srv.public_key,
         interface=wg_srv.interface, listen_port=wg_srv.listen_port,
@@ -1329,7 +1328,7 @@ async def xray_subscription(access_token: str, db: DBSession):
     if not xray_srv or not xray_srv.is_enabled:
         raise HTTPException(status_code=404, detail="XRay server not configured")
 
-    xray_domain = get_configured_domain() or xray_manager.get_server_ip()
+    xray_domain = get_configured_domain() or await xray_manager.get_server_ip_async()
     xray_settings = XrayServerSettings(
         port=xray_srv.port, private_key=xray_srv.private_key,
         public_key=xray_srv.public_key, short_id=xray_srv.short_id,
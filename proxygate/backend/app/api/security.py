@@ -1,7 +1,7 @@
 """
 Security API endpoints - brute force protection management
 """
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy import select, func
@@ -25,6 +25,16 @@ from app.services.security_service import SecurityService
 router = APIRouter(prefix="/security", tags=["security"])
 
 
+def _keyset(after_time: Optional[datetime], after_id: Optional[int]) -> Optional[tuple[datetime, int]]:
+    """Keyset cursor from query params; both parts are required"""
+    if after_time is None or after_id is None:
+        return None
+    # Columns are naive UTC; an offset in the cursor would break the comparison
+    if after_time.tzinfo is not None:
+        after_time = after_time.astimezone(timezone.utc).replace(tzinfo=None)
+    return after_time, after_id
+
+
 @router.get("/stats", response_model=SecurityStatsResponse)
 async def get_security_stats(
     db: AsyncSession = Depends(get_db),
@@ -35,15 +45,10 @@ async def get_security_stats(
     today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
     yesterday = now - timedelta(hours=24)
 
-    # Active blocks
-    result = await db.execute(
-        select(func.count(BlockedIP.id)).where(BlockedIP.is_active == True)
-    )
-    active_blocks = result.scalar() or 0
-
-    # Total blocks (all time)
-    result = await db.execute(select(func.count(BlockedIP.id)))
-    total_blocks = result.scalar() or 0
+    # Active and all-time blocks (short-lived cached counts)
+    security = SecurityService(db)
+    active_blocks = await security.get_blocked_ip_count(active_only=True)
+    total_blocks = await security.get_blocked_ip_count(active_only=False, estimate=True)
 
     # Failed attempts in last 24h
     result = await db.execute(
@@ -77,17 +82,25 @@ async def get_blocked_ips(
     page: int = Query(1, ge=1),
     per_page: int = Query(20, ge=1, le=100),
     active_only: bool = Query(True),
+    after_time: Optional[datetime] = None,
+    after_id: Optional[int] = None,
     db: AsyncSession = Depends(get_db),
     current_admin: AdminUser = Depends(get_current_admin)
 ):
-    """Get list of blocked IPs"""
+    """
+    Get list of blocked IPs.
+
+    Pass after_time/after_id (blocked_at and id of the last item seen) for
+    keyset pagination instead of deep page numbers.
+    """
     security = SecurityService(db)
 
     offset = (page - 1) * per_page
     blocked = await security.get_blocked_ips(
         active_only=active_only,
         limit=per_page,
-        offset=offset
+        offset=offset,
+        after=_keyset(after_time, after_id)
     )
     total = await security.get_blocked_ip_count(active_only=active_only)
 
@@ -169,14 +182,17 @@ async def get_blocked_ip_details(
 async def get_failed_attempts(
     ip_address: Optional[str] = None,
     limit: int = Query(100, ge=1, le=500),
+    after_time: Optional[datetime] = None,
+    after_id: Optional[int] = None,
     db: AsyncSession = Depends(get_db),
     current_admin: AdminUser = Depends(get_current_admin)
 ):
-    """Get recent failed login attempts"""
+    """Get recent failed login attempts (after_time/after_id: next page)"""
     security = SecurityService(db)
     attempts = await security.get_recent_failed_attempts(
         ip_address=ip_address,
-        limit=limit
+        limit=limit,
+        after=_keyset(after_time, after_id)
     )
     return [FailedLoginResponse.model_validate(a) for a in attempts]
 
@@ -185,14 +201,17 @@ async def get_failed_attempts(
 async def get_security_events(
     event_type: Optional[str] = None,
     limit: int = Query(100, ge=1, le=500),
+    after_time: Optional[datetime] = None,
+    after_id: Optional[int] = None,
     db: AsyncSession = Depends(get_db),
     current_admin: AdminUser = Depends(get_current_admin)
 ):
-    """Get security events log"""
+    """Get security events log (after_time/after_id: next page)"""
     security = SecurityService(db)
     events = await security.get_security_events(
         event_type=event_type,
-        limit=limit
+        limit=limit,
+        after=_keyset(after_time, after_id)
     )
     return [SecurityEventResponse.model_validate(e) for e in events]
 
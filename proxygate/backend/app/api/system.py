@@ -63,11 +63,52 @@ class SystemStatusResponse(BaseModel):
     system_info: Dict
 
 
+# Parsed settings keyed by the settings file mtime, so every worker picks up
+# saves made by any process without re-reading the file on each call. Only
+# what's on disk is cached; the public-IP probe for an unset server_ip runs
+# where it's needed, so a changed address is never pinned here.
+_settings_cache: Optional[tuple] = None
+# Bumped whenever the cached settings are (re)loaded; lets other modules
+# keep derived values until the settings actually change
+_settings_version = 0
+
+
+def _settings_mtime() -> Optional[int]:
+    try:
+        return SYSTEM_SETTINGS_FILE.stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+def _cached_settings() -> dict:
+    """Cached settings dict, reloaded (and versioned) when the file changes."""
+    global _settings_cache, _settings_version
+    mtime = _settings_mtime()
+    if _settings_cache is None or _settings_cache[0] != mtime:
+        _settings_cache = (mtime, _read_system_settings())
+        _settings_version += 1
+    return _settings_cache[1]
+
+
+def get_settings_version() -> int:
+    """Version of the current system settings; changes on every save/edit."""
+    _cached_settings()
+    return _settings_version
+
+
 def load_system_settings() -> dict:
-    """Load saved system settings."""
+    """Load saved system settings, detecting the server IP if none is set."""
+    settings = dict(_cached_settings())
+    if not settings["server_ip"]:
+        settings["server_ip"] = get_server_ip()
+    return settings
+
+
+def _read_system_settings() -> dict:
+    """Read system settings from disk, filling in static defaults."""
     defaults = {
         "domain": "",
-        "server_ip": get_server_ip(),
+        "server_ip": "",
         "vpn_subnet": "10.10.10.0/24",
         "dns_servers": "8.8.8.8,8.8.4.4",
         "http_proxy_port": 3128,
@@ -87,19 +128,19 @@ def load_system_settings() -> dict:
 
 def get_configured_domain() -> str:
     """Get the configured domain from system settings."""
-    settings = load_system_settings()
+    settings = _cached_settings()
     return settings.get("domain", "") or "localhost"
 
 
 def get_configured_server_ip() -> str:
     """Get the configured server IP from system settings."""
-    settings = load_system_settings()
+    settings = _cached_settings()
     return settings.get("server_ip", "") or get_server_ip() or "127.0.0.1"
 
 
 def get_configured_ports() -> tuple:
     """Get HTTP and SOCKS proxy ports from system settings."""
-    settings = load_system_settings()
+    settings = _cached_settings()
     return (
         settings.get("http_proxy_port", 3128),
         settings.get("socks_proxy_port", 1080)
@@ -108,16 +149,18 @@ def get_configured_ports() -> tuple:
 
 def get_configured_web_port() -> int:
     """Get the web/admin panel port from system settings."""
-    settings = load_system_settings()
+    settings = _cached_settings()
     return settings.get("web_port", 8443)
 
 
 def save_system_settings(data: dict):
     """Save system settings."""
+    global _settings_cache
     SYSTEM_SETTINGS_FILE.parent.mkdir(parents=True, exist_ok=True)
     with open(SYSTEM_SETTINGS_FILE, 'w') as f:
         json.dump(data, f)
     os.chmod(SYSTEM_SETTINGS_FILE, 0o600)
+    _settings_cache = None
 
 
 def get_server_ip() -> str:
@@ -225,7 +225,7 @@ async def get_client_wireguard_config(
     if client.wireguard_config:
         config_text = None
         if server_config:
-            server_ip = wg_manager.get_server_ip()
+            server_ip = await wg_manager.get_server_ip_async()
             server_settings = WgServerSettings(
                 private_key=server_config.private_key,
                 public_key=server_config.public_key,
@@ -411,4 +411,5 @@ async def _reload_wireguard_config(db: AsyncSession, server_config: WireguardSer
     )
 
     wg_manager.write_server_config(server_settings, clients)
-    wg_manager.reload()
+    if not wg_manager.apply_peer_changes(server_settings, clients):
+        wg_manager.reload()
@@ -247,7 +247,7 @@ async def get_client_xray_config(
     if client.xray_config:
         vless_url = None
         if server_config:
-            xray_domain = get_configured_domain() or xray_manager.get_server_ip()
+            xray_domain = get_configured_domain() or await xray_manager.get_server_ip_async()
             server_settings = XrayServerSettings(
                 port=server_config.port,
                 private_key=server_config.private_key,
@@ -395,5 +395,5 @@ async def _reload_xray_config(db: AsyncSession, server_config: XrayServerConfig)
         server_name=server_config.server_name
     )
 
-    xray_manager.write_config(server_settings, clients)
-    xray_manager.reload()
+    if xray_manager.write_config(server_settings, clients):
+        xray_manager.reload()
@@ -1,5 +1,6 @@
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from typing import AsyncGenerator
 import os
 
@@ -10,10 +11,13 @@ from app.config import settings
 os.makedirs("data", exist_ok=True)
 
 # Create async engine
+# AsyncAdaptedQueuePool is set explicitly so waiting for a free connection
+# never falls back to a blocking pool and stalls the event loop
 engine = create_async_engine(
     settings.database_url,
     echo=False,
     future=True,
+    poolclass=AsyncAdaptedQueuePool,
     pool_size=20,
     max_overflow=10,
     pool_pre_ping=True,
@@ -49,6 +53,11 @@ async def get_db() -> AsyncGenerator[AsyncSession, None]:
 
 async def init_db():
     """Initialize database tables."""
+    if engine.dialect.name == "sqlite":
+        # WAL is persistent in the database file; it lets readers (and the
+        # online backup) run alongside a writer instead of blocking on it
+        async with engine.connect() as conn:
+            await conn.exec_driver_sql("PRAGMA journal_mode=WAL")
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
 
@@ -1,4 +1,7 @@
+import logging
+import queue
 from contextlib import asynccontextmanager
+from logging.handlers import QueueHandler, QueueListener
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
@@ -8,16 +11,50 @@ from app.database import init_db, close_db
 from app.api import api_router
 from app.api.system import get_app_version
 from app.middleware.security import SecurityMiddleware
+from app.services.security_service import (
+    start_failure_writer,
+    stop_failure_writer,
+    start_blocklist_listener,
+    stop_blocklist_listener,
+)
+from app.services.telegram_bot import notifier
+
+
+def setup_logging() -> QueueListener:
+    """
+    Route the app.* loggers through a queue so request handlers only enqueue
+    records; a background thread does the formatting and stderr writes.
+    """
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    listener = QueueListener(log_queue, handler)
+
+    app_logger = logging.getLogger("app")
+    app_logger.addHandler(QueueHandler(log_queue))
+    app_logger.setLevel(logging.INFO)
+    app_logger.propagate = False
+
+    listener.start()
+    return listener
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan handler."""
     # Startup
+    log_listener = setup_logging()
     await init_db()
+    await notifier.warmup()
+    start_failure_writer()
+    start_blocklist_listener()
     yield
     # Shutdown
+    await stop_blocklist_listener()
+    await stop_failure_writer()
+    await notifier.close()
     await close_db()
+    log_listener.stop()
 
 
 app = FastAPI(
@@ -3,11 +3,11 @@ Security middleware for brute force protection
 """
 from fastapi import Request, HTTPException
 from starlette.middleware.base import BaseHTTPMiddleware
-from sqlalchemy import select
 from datetime import datetime
 
 from app.database import async_session_maker
 from app.models.security import BlockedIP
+from app.services.security_service import SecurityService
 
 
 class SecurityMiddleware(BaseHTTPMiddleware):
@@ -62,30 +62,9 @@ class SecurityMiddleware(BaseHTTPMiddleware):
         return "unknown"
 
     async def _check_blocked(self, ip_address: str) -> tuple[bool, BlockedIP | None]:
-        """Check if IP is blocked"""
+        """Check if IP is blocked (served from the in-memory blocklist when not)"""
         async with async_session_maker() as db:
-            result = await db.execute(
-                select(BlockedIP).where(
-                    BlockedIP.ip_address == ip_address,
-                    BlockedIP.is_active == True
-                )
-            )
-            block = result.scalar_one_or_none()
-
-            if not block:
-                return False, None
-
-            # Check if temporary block has expired
-            if not block.is_permanent and block.blocked_until:
-                if datetime.utcnow() > block.blocked_until:
-                    # Auto-unblock expired temporary blocks
-                    block.is_active = False
-                    block.unblocked_at = datetime.utcnow()
-                    block.notes = "Auto-unblocked: temporary block expired"
-                    await db.commit()
-                    return False, None
-
-            return True, block
+            return await SecurityService(db).is_ip_blocked(ip_address)
 
 
 def get_client_ip(request: Request) -> str:
@@ -1,4 +1,5 @@
-from typing import TYPE_CHECKING, Optional
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional, Tuple
 from sqlalchemy import String, ForeignKey, Text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
@@ -8,6 +9,14 @@ if TYPE_CHECKING:
     from app.models.client import Client
 
 
+@lru_cache(maxsize=4096)
+def split_allowed_ips(allowed_ips: Optional[str]) -> Tuple[str, ...]:
+    """Parse the comma-separated allowed_ips column; cached per raw value."""
+    if not allowed_ips:
+        return ()
+    return tuple(ip.strip() for ip in allowed_ips.split(",") if ip.strip())
+
+
 class ProxyAccount(Base):
     __tablename__ = "proxy_accounts"
 
@@ -21,3 +30,8 @@ class ProxyAccount(Base):
     allowed_ips: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
 
     client: Mapped["Client"] = relationship(back_populates="proxy_account")
+
+    @property
+    def allowed_ip_list(self) -> Tuple[str, ...]:
+        """Parsed allowed_ips; tracks column edits since it's keyed by value."""
+        return split_allowed_ips(self.allowed_ips)
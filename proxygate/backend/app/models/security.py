@@ -1,11 +1,28 @@
 """
 Security models for brute force protection
 """
-from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, Index, text
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
 from app.database import Base
 
 
+class utcnow(FunctionElement):
+    """Current time as naive UTC, evaluated by the database"""
+    type = DateTime()
+    inherit_cache = True
+
+
+@compiles(utcnow, "postgresql")
+def _pg_utcnow(element, compiler, **kw):
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+
+
+@compiles(utcnow, "sqlite")
+def _sqlite_utcnow(element, compiler, **kw):
+    return "(STRFTIME('%Y-%m-%d %H:%M:%f', 'now'))"
+
+
 class FailedLogin(Base):
     """Track failed login attempts"""
     __tablename__ = "failed_logins"
@@ -15,7 +32,12 @@ class FailedLogin(Base):
     username = Column(String(255), nullable=True)  # attempted username
     user_agent = Column(Text, nullable=True)
     endpoint = Column(String(100))  # /api/auth/login, /api/portal/auth, etc.
-    attempt_time = Column(DateTime, default=datetime.utcnow)
+    attempt_time = Column(DateTime, server_default=utcnow())
+
+    __table_args__ = (
+        # Per-IP window lookups in record_failed_attempt
+        Index("ix_failed_logins_ip_address_attempt_time", "ip_address", "attempt_time"),
+    )
 
 
 class BlockedIP(Base):
@@ -26,7 +48,7 @@ class BlockedIP(Base):
     ip_address = Column(String(45), unique=True, index=True)
     reason = Column(String(255))  # "Too many failed login attempts"
     failed_attempts = Column(Integer, default=0)
-    blocked_at = Column(DateTime, default=datetime.utcnow)
+    blocked_at = Column(DateTime, server_default=utcnow())
     blocked_until = Column(DateTime, nullable=True)  # null = permanent
     is_permanent = Column(Boolean, default=False)
     unblocked_at = Column(DateTime, nullable=True)
@@ -34,6 +56,18 @@ class BlockedIP(Base):
     is_active = Column(Boolean, default=True)  # false = unblocked
     notes = Column(Text, nullable=True)
 
+    __table_args__ = (
+        # Only live blocks; serves the blocklist load in SecurityService
+        Index(
+            "ix_blocked_ips_active_ip",
+            "ip_address",
+            postgresql_where=text("is_active"),
+            sqlite_where=text("is_active"),
+        ),
+    )
+    # Fetch the server-side blocked_at back with RETURNING on insert
+    __mapper_args__ = {"eager_defaults": True}
+
 
 class SecurityEvent(Base):
     """Security audit log"""
@@ -44,4 +78,4 @@ class SecurityEvent(Base):
     ip_address = Column(String(45), nullable=True)
     username = Column(String(255), nullable=True)
     details = Column(Text, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, server_default=utcnow())
@@ -18,7 +18,7 @@ class WireguardConfig(Base):
 
     # WireGuard keys
     private_key: Mapped[str] = mapped_column(String(64))
-    public_key: Mapped[str] = mapped_column(String(64))
+    public_key: Mapped[str] = mapped_column(String(64), index=True)  # traffic stats match peers by key
 
     # Preshared key for additional security (optional)
     preshared_key: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
@@ -1,5 +1,5 @@
 import ipaddress
-from typing import List, Dict, Set
+from typing import Dict, Iterable, List, Set
 
 
 class DomainResolver:
@@ -84,6 +84,10 @@ class DomainResolver:
     # Default CIDR for unknown domains
     DEFAULT_CIDRS = ["104.16.0.0/12", "172.64.0.0/13"]  # Cloudflare ranges
 
+    def __init__(self):
+        # The mapping is static, so a lookup never goes stale
+        self._cache: Dict[str, List[str]] = {}
+
     def resolve_domain(self, domain: str, include_subdomains: bool = True) -> List[str]:
         """
         Resolve a domain to list of CIDRs.
@@ -94,19 +98,23 @@ class DomainResolver:
 
         Returns list of CIDR strings.
         """
+        cidrs = self._cache.get(domain)
+        if cidrs is None:
+            cidrs = self._cache[domain] = self._lookup(domain)
+        return cidrs
+
+    def _lookup(self, domain: str) -> List[str]:
         domain = domain.lower().strip()
 
         # Remove www. prefix
         if domain.startswith("www."):
             domain = domain[4:]
 
-        # Check known CIDRs
-        if domain in self.KNOWN_CIDRS:
-            return self.KNOWN_CIDRS[domain]
-
-        # Check if it's a subdomain of a known domain
-        for known_domain, cidrs in self.KNOWN_CIDRS.items():
-            if domain.endswith(f".{known_domain}"):
+        # Check the domain itself, then each parent domain (a.b.c → b.c → c)
+        labels = domain.split(".")
+        for i in range(len(labels)):
+            cidrs = self.KNOWN_CIDRS.get(".".join(labels[i:]))
+            if cidrs is not None:
                 return cidrs
 
         # Return default CDN ranges for unknown domains
@@ -122,6 +130,10 @@ class DomainResolver:
 
         return self.optimize_routes(list(all_cidrs))
 
+    def resolve_many(self, domains: Iterable[str]) -> Dict[str, List[str]]:
+        """Resolve each distinct domain once: {domain: CIDRs}."""
+        return {domain: self.resolve_domain(domain) for domain in set(domains)}
+
     def optimize_routes(self, cidrs: List[str]) -> List[str]:
         """
         Optimize route list:
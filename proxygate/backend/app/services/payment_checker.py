@@ -1,13 +1,23 @@
+import asyncio
 from datetime import date, timedelta
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, func
 from sqlalchemy.orm import selectinload
 
 from app.models import Client, Payment
 from app.services.telegram_bot import notifier
 
 
+def _latest_payments():
+    """Subquery: latest valid_until per client (clients without payments are absent)."""
+    return (
+        select(Payment.client_id, func.max(Payment.valid_until).label("valid_until"))
+        .group_by(Payment.client_id)
+        .subquery()
+    )
+
+
 class PaymentChecker:
     """
     Checks payment status and handles expiration.
@@ -22,13 +32,18 @@ class PaymentChecker:
         Returns summary of actions taken.
         """
         today = date.today()
+        latest = _latest_payments()
 
         result = await db.execute(
-            select(Client)
-            .options(selectinload(Client.payments))
+            select(Client, latest.c.valid_until)
+            .outerjoin(latest, latest.c.client_id == Client.id)
+            .options(
+                selectinload(Client.vpn_config),
+                selectinload(Client.proxy_account)
+            )
             .where(Client.is_active == True)
         )
-        clients = result.scalars().all()
+        rows = result.all()
 
         summary = {
             "deactivated": [],
@@ -36,30 +51,49 @@ class PaymentChecker:
             "checked": 0
         }
 
-        for client in clients:
+        # Phase 1: DB changes only. Notifications are collected and sent after
+        # commit so Telegram round-trips don't pin a pooled connection.
+        deactivated = []
+        warnings = []
+
+        for client, valid_until in rows:
             summary["checked"] += 1
 
-            if not client.payments:
+            if valid_until is None:
                 continue
 
-            # Get latest payment
-            latest_payment = max(client.payments, key=lambda p: p.valid_until)
-            days_left = (latest_payment.valid_until - today).days
+            days_left = (valid_until - today).days
 
             # Expired - deactivate
             if days_left < 0:
-                await self._deactivate_client(client, db)
+                self._deactivate_client(client)
+                deactivated.append((client.name, client.telegram_id))
                 summary["deactivated"].append(client.name)
 
             # Expiring soon - warn (3 days, 1 day)
             elif days_left in [3, 1]:
-                await self._send_warning(client, days_left)
+                if client.telegram_id:
+                    warnings.append((client.telegram_id, client.name, days_left))
                 summary["warned"].append((client.name, days_left))
 
         await db.commit()
+
+        # Phase 2: notifications, outside the transaction. Deactivation notices
+        # overlap like the reminders, and are bounded the same way so a mass
+        # expiry doesn't trip Telegram's flood limit.
+        semaphore = asyncio.Semaphore(notifier.BULK_SEND_CONCURRENCY)
+
+        async def notify_one(name: str, telegram_id: Optional[str]):
+            async with semaphore:
+                await self._notify_deactivation(name, telegram_id)
+
+        await asyncio.gather(
+            *(notify_one(name, telegram_id) for name, telegram_id in deactivated),
+            notifier.send_payment_reminders_bulk(warnings)
+        )
         return summary
 
-    async def _deactivate_client(self, client: Client, db: AsyncSession):
+    def _deactivate_client(self, client: Client):
         """Deactivate client due to expired payment."""
         client.is_active = False
 
@@ -71,51 +105,34 @@ class PaymentChecker:
         if client.proxy_account:
             client.proxy_account.is_active = False
 
-        # Notify admin
+    async def _notify_deactivation(self, client_name: str, telegram_id: Optional[str]):
+        """Notify admin and client about deactivation."""
         await notifier.notify_admin(
             f"<b>Клиент деактивирован</b>\n\n"
-            f"Имя: {client.name}\n"
+            f"Имя: {client_name}\n"
             f"Причина: истекла оплата"
         )
 
-        # Notify client
-        if client.telegram_id:
+        if telegram_id:
             await notifier.notify_client(
-                client.telegram_id,
+                telegram_id,
                 f"<b>ZETIT FNA</b>\n\n"
-                f"{client.name}, ваша подписка истекла.\n"
+                f"{client_name}, ваша подписка истекла.\n"
                 f"Доступ временно приостановлен.\n\n"
                 f"Для продления обратитесь к администратору."
             )
 
-    async def _send_warning(self, client: Client, days_left: int):
-        """Send expiration warning to client."""
-        if client.telegram_id:
-            await notifier.send_payment_reminder(
-                client.telegram_id,
-                client.name,
-                days_left
-            )
-
     async def find_expired(self, db: AsyncSession) -> List[Client]:
         """Find all clients with expired payments."""
         today = date.today()
+        latest = _latest_payments()
 
         result = await db.execute(
             select(Client)
-            .options(selectinload(Client.payments))
-            .where(Client.is_active == True)
+            .join(latest, latest.c.client_id == Client.id)
+            .where(Client.is_active == True, latest.c.valid_until < today)
         )
-        clients = result.scalars().all()
-
-        expired = []
-        for client in clients:
-            if client.payments:
-                latest = max(client.payments, key=lambda p: p.valid_until)
-                if latest.valid_until < today:
-                    expired.append(client)
-
-        return expired
+        return list(result.scalars().all())
 
     async def find_expiring_soon(
         self,
@@ -125,20 +142,17 @@ class PaymentChecker:
         """Find clients expiring within N days."""
         today = date.today()
         threshold = today + timedelta(days=days)
+        latest = _latest_payments()
 
         result = await db.execute(
-            select(Client)
-            .options(selectinload(Client.payments))
-            .where(Client.is_active == True)
+            select(Client, latest.c.valid_until)
+            .join(latest, latest.c.client_id == Client.id)
+            .where(
+                Client.is_active == True,
+                latest.c.valid_until >= today,
+                latest.c.valid_until <= threshold
+            )
+            .order_by(latest.c.valid_until)
         )
-        clients = result.scalars().all()
-
-        expiring = []
-        for client in clients:
-            if client.payments:
-                latest = max(client.payments, key=lambda p: p.valid_until)
-                days_left = (latest.valid_until - today).days
-                if 0 <= days_left <= days:
-                    expiring.append((client, days_left))
 
-        return sorted(expiring, key=lambda x: x[1])
+        return [(client, (valid_until - today).days) for client, valid_until in result.all()]
@@ -1,58 +1,58 @@
-import json
-import uuid
+import io
+import ipaddress
+from uuid import uuid4
 from datetime import datetime
-from typing import TYPE_CHECKING
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Callable, Optional, Union
+
+import orjson
 
 from app.config import settings
 from app.services.domain_resolver import DomainResolver
-from app.api.system import get_configured_domain, get_configured_server_ip, get_configured_ports
+from app.api.system import get_configured_domain, get_configured_server_ip
 
 if TYPE_CHECKING:
     from app.models import Client
 
 
-class ProfileGenerator:
-    """Generates VPN/Proxy profiles for all platforms."""
+def _prefix_to_mask(bits: int) -> str:
+    """Convert IPv4 prefix length to dotted netmask (24 -> 255.255.255.0)."""
+    value = (0xFFFFFFFF << (32 - bits)) & 0xFFFFFFFF
+    return ".".join(str((value >> shift) & 0xFF) for shift in (24, 16, 8, 0))
 
-    def __init__(self):
-        self.resolver = DomainResolver()
 
-    def _get_client_routes(self, client: "Client") -> list[str]:
-        """Get routes for a client from their domains."""
-        if client.vpn_config and client.vpn_config.resolved_routes:
-            return json.loads(client.vpn_config.resolved_routes)
+# Prefix length -> netmask lookup table ("0.0.0.0" .. "255.255.255.255")
+_MASKS = {bits: _prefix_to_mask(bits) for bits in range(33)}
 
-        # Resolve domains to CIDRs
-        routes = []
-        for domain in client.domains:
-            if domain.is_active:
-                routes.extend(self.resolver.resolve_domain(domain.domain))
 
-        return list(set(routes))
+def _ipv4_to_int(address: str) -> Optional[int]:
+    """Parse a dotted-quad IPv4 address; None if it isn't one."""
+    octets = address.split(".")
+    if len(octets) != 4:
+        return None
+    value = 0
+    for octet in octets:
+        # Same rules as ipaddress: ASCII digits, no leading zeros, <= 255
+        if not (octet.isascii() and octet.isdigit()) or len(octet) > 3 \
+                or (octet[0] == "0" and len(octet) > 1) or int(octet) > 255:
+            return None
+        value = (value << 8) | int(octet)
+    return value
 
-    def _get_client_domains(self, client: "Client") -> list[str]:
-        """Get list of active domains for a client (for VPN On Demand)."""
-        domains = []
-        for d in client.domains:
-            if d.is_active:
-                # Use wildcard only - covers base domain and all subdomains
-                domains.append(f"*.{d.domain}")
-        return domains
 
-    def generate_windows_ps1(self, client: "Client") -> str:
-        """Generate Windows PowerShell script for VPN setup."""
-        routes = self._get_client_routes(client)
-        domain = get_configured_domain()
+_ROUTE_DICT_XML = """                    <dict>
+                        <key>Address</key>
+                        <string>{address}</string>
+                        <key>SubnetMask</key>
+                        <string>{mask}</string>
+                    </dict>"""
 
-        routes_commands = "\n".join([
-            f'Add-VpnConnectionRoute -ConnectionName $VpnName -DestinationPrefix "{route}" -PassThru | Out-Null'
-            for route in routes
-        ])
+_PS1_ROUTE = 'Add-VpnConnectionRoute -ConnectionName $VpnName -DestinationPrefix "{route}" -PassThru | Out-Null'
 
-        script = f'''# ============================================
+_PS1_TEMPLATE = """# ============================================
 # ZETIT FNA - Windows VPN Setup
-# Client: {client.name}
-# Date: {datetime.now().strftime("%Y-%m-%d")}
+# Client: {client_name}
+# Date: {date}
 # ============================================
 # Run this script as Administrator!
 # Right-click -> "Run as administrator"
@@ -61,7 +61,7 @@ class ProfileGenerator:
 $ErrorActionPreference = "Stop"
 $VpnName = "ZETIT FNA"
 $ServerAddress = "{domain}"
-$Username = "{client.vpn_config.username}"
+$Username = "{username}"
 
 Write-Host "=== ZETIT FNA Setup ===" -ForegroundColor Cyan
 Write-Host ""
@@ -118,66 +118,31 @@ Write-Host "   - Your configured domains"
 Write-Host " Other traffic goes directly."
 Write-Host ""
 Read-Host "Press Enter to exit"
-'''
-        return script
-
-    def generate_ios_mobileconfig(self, client: "Client", mode: str = "ondemand") -> bytes:
-        """
-        Generate iOS .mobileconfig profile with different VPN modes.
-
-        Modes:
-        - ondemand: VPN connects only when accessing listed domains (recommended)
-        - always: VPN always connected, split tunneling by IP routes
-        - full: VPN always connected, ALL traffic through VPN
-        """
-        routes = self._get_client_routes(client)
-        client_domains = self._get_client_domains(client)
-        server_domain = get_configured_domain()
-
-        profile_uuid = str(uuid.uuid4()).upper()
-        vpn_uuid = str(uuid.uuid4()).upper()
-
-        # Routes XML for split tunneling
-        routes_xml = "\n".join([
-            self._cidr_to_route_dict(route) for route in routes
-        ])
+"""
 
-        # Domains XML for on-demand rules
-        domains_xml = "\n".join([
-            f"                        <string>{d}</string>" for d in client_domains
-        ])
-
-        # Profile name based on mode
-        mode_names = {
-            "ondemand": "ZETIT FNA (Auto)",
-            "always": "ZETIT FNA (Split)",
-            "full": "ZETIT FNA (Full)"
-        }
-        profile_name = mode_names.get(mode, "ZETIT FNA")
+_DOMAIN_XML = "                        <string>{domain}</string>"
 
-        # IPv4 configuration based on mode
-        if mode == "full":
-            ipv4_config = """
+_IPV4_FULL_XML = b"""
             <key>IPv4</key>
             <dict>
                 <key>OverridePrimary</key>
                 <integer>1</integer>
             </dict>"""
-        else:
-            ipv4_config = f"""
+
+_IPV4_SPLIT_HEAD = b"""
             <key>IPv4</key>
             <dict>
                 <key>OverridePrimary</key>
                 <integer>0</integer>
                 <key>IncludedRoutes</key>
                 <array>
-{routes_xml}
+"""
+
+_IPV4_SPLIT_TAIL = b"""
                 </array>
             </dict>"""
 
-        # OnDemand rules based on mode
-        if mode == "ondemand":
-            ondemand_config = f"""
+_ONDEMAND_DOMAINS_HEAD = b"""
             <key>OnDemandEnabled</key>
             <integer>1</integer>
             <key>OnDemandRules</key>
@@ -190,7 +155,9 @@ Read-Host "Press Enter to exit"
                         <dict>
                             <key>Domains</key>
                             <array>
-{domains_xml}
+"""
+
+_ONDEMAND_DOMAINS_TAIL = b"""
                             </array>
                             <key>DomainAction</key>
                             <string>ConnectIfNeeded</string>
@@ -202,9 +169,8 @@ Read-Host "Press Enter to exit"
                     <string>Disconnect</string>
                 </dict>
             </array>"""
-        else:
-            # always or full - keep VPN connected
-            ondemand_config = """
+
+_ONDEMAND_ALWAYS_XML = b"""
             <key>OnDemandEnabled</key>
             <integer>1</integer>
             <key>OnDemandRules</key>
@@ -215,7 +181,7 @@ Read-Host "Press Enter to exit"
                 </dict>
             </array>"""
 
-        config = f'''<?xml version="1.0" encoding="UTF-8"?>
+_MOBILECONFIG_HEAD = """<?xml version="1.0" encoding="UTF-8"?>
 <!DOCTYPE plist PUBLIC "-//Apple//DTD PLIST 1.0//EN" "http://www.apple.com/DTDs/PropertyList-1.0.dtd">
 <plist version="1.0">
 <dict>
@@ -227,7 +193,7 @@ Read-Host "Press Enter to exit"
             <key>PayloadVersion</key>
             <integer>1</integer>
             <key>PayloadIdentifier</key>
-            <string>com.zetit.fna.vpn.{client.id}.{mode}</string>
+            <string>com.zetit.fna.vpn.{client_id}.{mode}</string>
             <key>PayloadUUID</key>
             <string>{vpn_uuid}</string>
             <key>PayloadDisplayName</key>
@@ -245,16 +211,16 @@ Read-Host "Press Enter to exit"
                 <key>RemoteIdentifier</key>
                 <string>{server_domain}</string>
                 <key>LocalIdentifier</key>
-                <string>{client.vpn_config.username}</string>
+                <string>{username}</string>
 
                 <key>AuthenticationMethod</key>
                 <string>None</string>
                 <key>ExtendedAuthEnabled</key>
                 <true/>
                 <key>AuthName</key>
-                <string>{client.vpn_config.username}</string>
+                <string>{username}</string>
                 <key>AuthPassword</key>
-                <string>{client.vpn_config.password}</string>
+                <string>{password}</string>
 
                 <key>IKESecurityAssociationParameters</key>
                 <dict>
@@ -278,15 +244,16 @@ Read-Host "Press Enter to exit"
                 <key>EnablePFS</key>
                 <true/>
             </dict>
-{ipv4_config}
-{ondemand_config}
+"""
+
+_MOBILECONFIG_TAIL = """
         </dict>
     </array>
 
     <key>PayloadDisplayName</key>
-    <string>{profile_name} - {client.name}</string>
+    <string>{profile_name} - {client_name}</string>
     <key>PayloadIdentifier</key>
-    <string>com.zetit.fna.profile.{client.id}.{mode}</string>
+    <string>com.zetit.fna.profile.{client_id}.{mode}</string>
     <key>PayloadOrganization</key>
     <string>ZETIT</string>
     <key>PayloadType</key>
@@ -298,8 +265,223 @@ Read-Host "Press Enter to exit"
     <key>PayloadRemovalDisallowed</key>
     <false/>
 </dict>
-</plist>'''
-        return config.encode('utf-8')
+</plist>"""
+
+# Domain lookup walks the host's parent suffixes against a JS object, so
+# evaluation cost depends on label count rather than the number of domains
+_PAC_TEMPLATE = """// PAC: {label}
+// Generated by ZETIT FNA
+var DOMAINS = {domains_json};
+
+function FindProxyForURL(url, host) {{
+    var h = host;
+    while (true) {{
+        if (DOMAINS[h] === 1) {{
+            return "HTTPS {proxy_host}:2053; HTTPS {proxy_host}:443; HTTPS {proxy_host}:8443; PROXY {proxy_host}:3128; DIRECT";
+        }}
+        var dot = h.indexOf(".");
+        if (dot < 0) {{
+            return "DIRECT";
+        }}
+        h = h.substring(dot + 1);
+    }}
+}}
+"""
+
+
+def _cidr_to_route_dict(cidr: str) -> str:
+    """Convert CIDR to iOS route dict XML.
+
+    IPv4 routes are parsed by hand and the mask is a table lookup; host
+    bits are cleared like ip_network(strict=False) would. Anything the
+    fast path can't parse goes through ipaddress.
+    """
+    if ":" not in cidr:
+        address, slash, prefix = cidr.partition("/")
+        if not slash:
+            prefix = "32"
+        value = _ipv4_to_int(address)
+        if value is not None and prefix.isascii() and prefix.isdigit() and int(prefix) in _MASKS:
+            bits = int(prefix)
+            value &= (0xFFFFFFFF << (32 - bits)) & 0xFFFFFFFF
+            address = ".".join(str((value >> shift) & 0xFF) for shift in (24, 16, 8, 0))
+            return _ROUTE_DICT_XML.format(address=address, mask=_MASKS[bits])
+
+    try:
+        network = ipaddress.ip_network(cidr, strict=False)
+        return _ROUTE_DICT_XML.format(address=network.network_address, mask=network.netmask)
+    except ValueError:
+        return ""
+
+
+def _write_lines(write, chunks) -> None:
+    """Write byte chunks separated by newlines (streaming b"\\n".join)."""
+    for i, chunk in enumerate(chunks):
+        if i:
+            write(b"\n")
+        write(chunk)
+
+
+class ProfileGenerator:
+    """Generates VPN/Proxy profiles for all platforms."""
+
+    # Max rendered profiles kept in memory (LRU)
+    PROFILE_CACHE_SIZE = 256
+
+    def __init__(self):
+        self.resolver = DomainResolver()
+        self._profile_cache: "OrderedDict[tuple, Union[str, bytes]]" = OrderedDict()
+
+    def _cache_key(self, platform: str, client: "Client", *extra) -> tuple:
+        """
+        Build a cache key from everything a rendered profile depends on.
+
+        The key is content-based (credentials, routes, active domains and the
+        configured server domain), so edits are picked up without explicit
+        invalidation.
+        """
+        vpn = client.vpn_config
+        return (
+            platform,
+            client.id,
+            client.name,
+            vpn.username if vpn else None,
+            vpn.password if vpn else None,
+            vpn.resolved_routes if vpn else None,
+            tuple(d.domain for d in client.domains if d.is_active),
+            get_configured_domain(),
+            *extra,
+        )
+
+    def _cached(self, key: tuple, build: Callable[[], Union[str, bytes]]) -> Union[str, bytes]:
+        """Return a rendered profile from the LRU cache, building it on miss."""
+        cache = self._profile_cache
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+
+        content = build()
+        cache[key] = content
+        if len(cache) > self.PROFILE_CACHE_SIZE:
+            cache.popitem(last=False)
+        return content
+
+    def _get_client_routes(self, client: "Client") -> list[str]:
+        """Get routes for a client from their domains."""
+        if client.vpn_config and client.vpn_config.resolved_routes:
+            return orjson.loads(client.vpn_config.resolved_routes)
+
+        # Resolve domains to CIDRs
+        routes = []
+        for domain in client.domains:
+            if domain.is_active:
+                routes.extend(self.resolver.resolve_domain(domain.domain))
+
+        # Keep first-seen order so generated profiles are deterministic
+        return list(dict.fromkeys(routes))
+
+    def _get_client_domains(self, client: "Client") -> list[str]:
+        """Get list of active domains for a client (for VPN On Demand)."""
+        domains = []
+        for d in client.domains:
+            if d.is_active:
+                # Use wildcard only - covers base domain and all subdomains
+                domains.append(f"*.{d.domain}")
+        return domains
+
+    def generate_windows_ps1(self, client: "Client") -> str:
+        """Generate Windows PowerShell script for VPN setup."""
+        today = datetime.now().strftime("%Y-%m-%d")
+        return self._cached(
+            self._cache_key("ps1", client, today),
+            lambda: self._build_windows_ps1(client, today)
+        )
+
+    def _build_windows_ps1(self, client: "Client", today: str) -> str:
+        routes = self._get_client_routes(client)
+        domain = get_configured_domain()
+
+        routes_commands = "\n".join(_PS1_ROUTE.format(route=route) for route in routes)
+
+        return _PS1_TEMPLATE.format(
+            client_name=client.name,
+            date=today,
+            domain=domain,
+            username=client.vpn_config.username,
+            routes_commands=routes_commands,
+        )
+
+    def generate_ios_mobileconfig(self, client: "Client", mode: str = "ondemand") -> bytes:
+        """
+        Generate iOS .mobileconfig profile with different VPN modes.
+
+        Modes:
+        - ondemand: VPN connects only when accessing listed domains (recommended)
+        - always: VPN always connected, split tunneling by IP routes
+        - full: VPN always connected, ALL traffic through VPN
+        """
+        return self._cached(
+            self._cache_key("mobileconfig", client, mode),
+            lambda: self._build_ios_mobileconfig(client, mode)
+        )
+
+    def _build_ios_mobileconfig(self, client: "Client", mode: str) -> bytes:
+        routes = self._get_client_routes(client)
+        client_domains = self._get_client_domains(client)
+        server_domain = get_configured_domain()
+
+        profile_uuid = str(uuid4()).upper()
+        vpn_uuid = str(uuid4()).upper()
+
+        # Profile name based on mode
+        mode_names = {
+            "ondemand": "ZETIT FNA (Auto)",
+            "always": "ZETIT FNA (Split)",
+            "full": "ZETIT FNA (Full)"
+        }
+        profile_name = mode_names.get(mode, "ZETIT FNA")
+
+        # Write segments straight into the buffer instead of building the
+        # whole document as one str and then encoding a second copy
+        buf = io.BytesIO()
+        write = buf.write
+        write(_MOBILECONFIG_HEAD.format(
+            client_id=client.id,
+            mode=mode,
+            vpn_uuid=vpn_uuid,
+            profile_name=profile_name,
+            server_domain=server_domain,
+            username=client.vpn_config.username,
+            password=client.vpn_config.password,
+        ).encode('utf-8'))
+
+        # IPv4 configuration based on mode
+        if mode == "full":
+            write(_IPV4_FULL_XML)
+        else:
+            # Routes for split tunneling
+            write(_IPV4_SPLIT_HEAD)
+            _write_lines(write, (_cidr_to_route_dict(route).encode('utf-8') for route in routes))
+            write(_IPV4_SPLIT_TAIL)
+        write(b"\n")
+
+        # OnDemand rules based on mode
+        if mode == "ondemand":
+            write(_ONDEMAND_DOMAINS_HEAD)
+            _write_lines(write, (_DOMAIN_XML.format(domain=d).encode('utf-8') for d in client_domains))
+            write(_ONDEMAND_DOMAINS_TAIL)
+        else:
+            # always or full - keep VPN connected
+            write(_ONDEMAND_ALWAYS_XML)
+
+        write(_MOBILECONFIG_TAIL.format(
+            client_id=client.id,
+            client_name=client.name,
+            mode=mode,
+            profile_uuid=profile_uuid,
+            profile_name=profile_name,
+        ).encode('utf-8'))
+        return buf.getvalue()
 
     def generate_macos_mobileconfig(self, client: "Client", mode: str = "ondemand") -> bytes:
         """Generate macOS .mobileconfig profile."""
@@ -308,11 +490,17 @@ Read-Host "Press Enter to exit"
 
     def generate_android_sswan(self, client: "Client") -> bytes:
         """Generate Android strongSwan .sswan profile."""
+        return self._cached(
+            self._cache_key("sswan", client),
+            lambda: self._build_android_sswan(client)
+        )
+
+    def _build_android_sswan(self, client: "Client") -> bytes:
         routes = self._get_client_routes(client)
         domain = get_configured_domain()
 
         profile = {
-            "uuid": str(uuid.uuid4()),
+            "uuid": str(uuid4()),
             "name": "ZETIT FNA",
             "type": "ikev2-eap",
             "remote": {
@@ -327,44 +515,21 @@ Read-Host "Press Enter to exit"
             }
         }
 
-        return json.dumps(profile, indent=2).encode('utf-8')
+        # strongSwan doesn't need pretty-printing
+        return orjson.dumps(profile)
 
     def generate_pac_file(self, client: "Client") -> str:
         """Generate PAC file for proxy auto-configuration."""
-        domains = [d.domain for d in client.domains if d.is_active]
-        proxy_host = get_configured_domain()
-        http_port, _ = get_configured_ports()
-
-        domain_checks = []
-        for domain in domains:
-            domain_checks.append(f'dnsDomainIs(host, ".{domain}")')
-            domain_checks.append(f'host === "{domain}"')
-
-        conditions = " ||\n        ".join(domain_checks)
-
-        pac = f'''// PAC: {client.vpn_config.username if client.vpn_config else client.name}
-// Generated by ZETIT FNA
-function FindProxyForURL(url, host) {{
-    if ({conditions}) {{
-        return "HTTPS {proxy_host}:2053; HTTPS {proxy_host}:443; HTTPS {proxy_host}:8443; PROXY {proxy_host}:3128; DIRECT";
-    }}
-    return "DIRECT";
-}}
-'''
-        return pac
-
-    def _cidr_to_route_dict(self, cidr: str) -> str:
-        """Convert CIDR to iOS route dict XML."""
-        import ipaddress
-        try:
-            network = ipaddress.ip_network(cidr, strict=False)
-            address = str(network.network_address)
-            mask = str(network.netmask)
-            return f'''                    <dict>
-                        <key>Address</key>
-                        <string>{address}</string>
-                        <key>SubnetMask</key>
-                        <string>{mask}</string>
-                    </dict>'''
-        except ValueError:
-            return ""
+        return self._cached(
+            self._cache_key("pac", client),
+            lambda: self._build_pac_file(client)
+        )
+
+    def _build_pac_file(self, client: "Client") -> str:
+        domains_json = orjson.dumps({d.domain: 1 for d in client.domains if d.is_active}).decode()
+
+        return _PAC_TEMPLATE.format(
+            label=client.vpn_config.username if client.vpn_config else client.name,
+            domains_json=domains_json,
+            proxy_host=get_configured_domain(),
+        )
@@ -1,13 +1,99 @@
+import hashlib
+import ipaddress
+import os
 import subprocess
 import signal
 import logging
-from typing import List
+import threading
+from typing import List, Optional, Set, Tuple
 from dataclasses import dataclass, field
+from functools import lru_cache
+
+from jinja2 import Environment
 
 from app.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Proxy ports guarded by the PROXYGATE chain
+PROXY_PORTS = ("2053", "8080", "3128", "1080", "2096")
+
+
+# (settings version, domain) - refreshed when the version changes
+_settings_snapshot: Tuple[int, str] = (-1, "")
+
+
+def _configured_domain() -> str:
+    """Configured domain, re-read only after a settings change."""
+    global _settings_snapshot
+    from app.api.system import get_configured_domain, get_settings_version
+    version = get_settings_version()
+    if _settings_snapshot[0] != version:
+        _settings_snapshot = (version, get_configured_domain())
+    return _settings_snapshot[1]
+
+
+def _configured_server_ip() -> str:
+    # Not snapshotted: an unset server_ip falls back to probing the public IP
+    from app.api.system import get_configured_server_ip
+    return get_configured_server_ip()
+
+
+@lru_cache(maxsize=8192)
+def _wild(domain: str) -> str:
+    """Subdomain wildcard for a domain; rebuilds mostly repeat the same set."""
+    return f"*.{domain}"
+
+
+# 3proxy.cfg template, compiled once at import
+_CONFIG_TEMPLATE = Environment(
+    trim_blocks=True,
+    lstrip_blocks=True,
+    keep_trailing_newline=True,
+).from_string("""daemon
+# ProxyGate 3proxy configuration
+# Auto-generated - DO NOT EDIT MANUALLY
+
+nserver 1.1.1.1
+nserver 8.8.8.8
+nscache 65536
+timeouts 10 10 120 300 600 1800 5 60
+
+maxconn 500
+stacksize 262144
+
+log /var/log/3proxy/3proxy.log D
+logformat "L%d-%m-%Y %H:%M:%S %U %C:%c %R:%r %O %I %T"
+rotate 30
+
+auth iponly strong
+users ${{ passwd_path }}
+
+# === Per-client ACL ===
+{% if all_domains_str %}
+
+# TLS proxy passthrough — IP filtering done by iptables on proxy ports
+allow * 127.0.0.1 {{ all_domains_str }} * *
+{% endif %}
+{% for client, domains_str in client_domains if domains_str %}
+{% for ip in client.allowed_ips %}
+
+# IP whitelist for {{ client.username }}
+allow * {{ ip }} {{ domains_str }} * *
+{% endfor %}
+
+# {{ client.username }}
+allow {{ client.username }} * {{ domains_str }} * *
+{% endfor %}
+
+# === Deny all other ===
+deny *
+
+# === Proxy servers ===
+proxy -p3128 -a -n
+socks -p1080 -a -n
+""")
+
 
 @dataclass
 class ProxyDomain:
@@ -35,107 +121,58 @@ class ProxyManager:
     CONFIG_PATH = "/etc/3proxy/3proxy.cfg"
     PASSWD_PATH = "/etc/3proxy/passwd"
 
-    def generate_config(self, clients: List[ProxyClient]) -> str:
+    # Digest of the last successfully applied state. Class-level because
+    # callers create a fresh ProxyManager for every rebuild.
+    _applied_hash: Optional[bytes] = None
+    # Serializes applies: rebuilds run in worker threads and share temp files
+    _apply_lock = threading.Lock()
+
+    def generate_config(self, clients: List[ProxyClient]) -> Tuple[str, Set[str]]:
         """
         Generate full 3proxy configuration.
 
         Per-client ACL with domain whitelist and IP-based access.
+        Returns the config text and the set of whitelisted IPs of active
+        clients, collected in the same pass for the iptables sync.
         Connections from 127.0.0.1 (nginx TLS proxy) are allowed without auth —
         IP filtering is handled by iptables on nginx TLS ports.
         """
-        config = f'''daemon
-# ProxyGate 3proxy configuration
-# Auto-generated - DO NOT EDIT MANUALLY
-
-nserver 1.1.1.1
-nserver 8.8.8.8
-nscache 65536
-timeouts 10 10 120 300 600 1800 5 60
-
-maxconn 500
-stacksize 262144
-
-log /var/log/3proxy/3proxy.log D
-logformat "L%d-%m-%Y %H:%M:%S %U %C:%c %R:%r %O %I %T"
-rotate 30
-
-auth iponly strong
-users ${self.PASSWD_PATH}
-
-# === Per-client ACL ===
-'''
-
-        # Collect all domains from all active clients for TLS proxy access
+        # Expand each active client's domains once; the result feeds both the
+        # TLS passthrough rule and the per-client rules below
+        client_domains = []
         all_domains_expanded = []
+        all_ips = set()
         for client in clients:
-            if client.is_active and client.domains:
+            if client.is_active:
+                all_ips.update(client.allowed_ips)
+                expanded = []
                 for d in client.domains:
-                    all_domains_expanded.append(d.domain)
+                    expanded.append(d.domain)
                     if d.include_subdomains:
-                        all_domains_expanded.append(f"*.{d.domain}")
+                        expanded.append(_wild(d.domain))
+                all_domains_expanded.extend(expanded)
+                client_domains.append((client, ",".join(expanded)))
 
         # Add server's own domain for PAC re-fetch through proxy
         try:
-            from app.api.system import get_configured_domain
-            server_domain = get_configured_domain()
+            server_domain = _configured_domain()
             if server_domain and server_domain != "localhost":
                 all_domains_expanded.append(server_domain)
-                all_domains_expanded.append(f"*.{server_domain}")
+                all_domains_expanded.append(_wild(server_domain))
         except Exception:
             pass
 
-        # Deduplicate while preserving order
-        seen = set()
-        unique_domains = []
-        for d in all_domains_expanded:
-            if d not in seen:
-                seen.add(d)
-                unique_domains.append(d)
-
         # Allow TLS proxy connections (127.0.0.1) without auth
         # IP access control is enforced by iptables on proxy ports (2053/8080/3128/1080)
-        if unique_domains:
-            all_domains_str = ",".join(unique_domains)
-            config += f'''
-# TLS proxy passthrough — IP filtering done by iptables on proxy ports
-allow * 127.0.0.1 {all_domains_str} * *
-'''
-
-        for client in clients:
-            if client.is_active:
-                # Build domain list for this client
-                expanded = []
-                if client.domains:
-                    for d in client.domains:
-                        expanded.append(d.domain)
-                        if d.include_subdomains:
-                            expanded.append(f"*.{d.domain}")
-                domains_str = ",".join(expanded) if expanded else None
-
-                # IP-based allow rules (no auth, restricted to client's domains)
-                if domains_str and client.allowed_ips:
-                    for ip in client.allowed_ips:
-                        config += f'''
-# IP whitelist for {client.username}
-allow * {ip} {domains_str} * *
-'''
-
-                # Username-based allow rules (auth required)
-                if domains_str:
-                    config += f'''
-# {client.username}
-allow {client.username} * {domains_str} * *
-'''
-
-        config += f'''
-# === Deny all other ===
-deny *
+        # Deduplicate while preserving order
+        all_domains_str = ",".join(dict.fromkeys(all_domains_expanded))
 
-# === Proxy servers ===
-proxy -p3128 -a -n
-socks -p1080 -a -n
-'''
-        return config
+        config = _CONFIG_TEMPLATE.render(
+            passwd_path=self.PASSWD_PATH,
+            all_domains_str=all_domains_str,
+            client_domains=client_domains,
+        )
+        return config, all_ips
 
     def generate_passwd(self, clients: List[ProxyClient]) -> str:
         """
@@ -144,23 +181,41 @@ socks -p1080 -a -n
         Format: username:CL:password
         CL = cleartext password
         """
-        lines = []
-        for client in clients:
-            if client.is_active:
-                lines.append(f"{client.username}:CL:{client.password}")
-        return "\n".join(lines) + "\n"
+        return "".join(
+            f"{client.username}:CL:{client.password}\n"
+            for client in clients if client.is_active
+        ) or "\n"
 
     def write_config(self, clients: List[ProxyClient]) -> None:
         """Write configuration files."""
-        # Write main config
-        config = self.generate_config(clients)
-        with open(self.CONFIG_PATH, 'w') as f:
-            f.write(config)
+        config, _ = self.generate_config(clients)
+        self._write_files(config, self.generate_passwd(clients))
 
-        # Write passwd file
-        passwd = self.generate_passwd(clients)
-        with open(self.PASSWD_PATH, 'w') as f:
-            f.write(passwd)
+    def _write_files(self, config: str, passwd: str) -> None:
+        """Write main config and passwd file."""
+        self._atomic_write(self.CONFIG_PATH, config, 0o644)
+        # Cleartext passwords - owner only
+        self._atomic_write(self.PASSWD_PATH, passwd, 0o600)
+
+    @staticmethod
+    def _atomic_write(path: str, content: str, mode: int) -> None:
+        """
+        Write via a temp file + rename so a concurrent SIGHUP reload sees
+        either the old file or the complete new one, never a partial write.
+
+        No fsync: both files are regenerated from the DB by
+        rebuild_proxy_config, so surviving a power loss isn't needed.
+        """
+        tmp_path = f"{path}.tmp"
+        data = memoryview(content.encode())
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC, mode)
+        try:
+            # One write() for the whole file; loop only on a short write
+            while data:
+                data = data[os.write(fd, data):]
+        finally:
+            os.close(fd)
+        os.replace(tmp_path, path)
 
     def reload(self) -> bool:
         """
@@ -177,7 +232,6 @@ socks -p1080 -a -n
             )
             pid = int(result.stdout.strip().split()[0])
 
-            import os
             os.kill(pid, signal.SIGHUP)
             return True
 
@@ -204,184 +258,205 @@ socks -p1080 -a -n
             return False
 
     def apply_changes(self, clients: List[ProxyClient]) -> bool:
-        """Full cycle: generate config + restart + update iptables (IPv4 + IPv6)."""
-        self.write_config(clients)
-        result = self.restart()
-        # Sync iptables PROXYGATE chain with all whitelisted IPs
-        all_ips = set()
-        for client in clients:
-            if client.is_active:
-                all_ips.update(client.allowed_ips)
-        self.sync_iptables_whitelist(all_ips)
-        self.sync_ip6tables_whitelist(all_ips)
-        return result
+        """
+        Full cycle: generate config + reload + update iptables (IPv4 + IPv6).
+
+        Skipped entirely when config, passwd, whitelisted IPs and server IP
+        are identical to the last successful apply.
+        """
+        config, all_ips = self.generate_config(clients)
+        passwd = self.generate_passwd(clients)
+
+        try:
+            server_ip = _configured_server_ip()
+        except Exception:
+            server_ip = ""
+
+        digest = hashlib.blake2b(
+            b"\0".join([
+                config.encode(),
+                passwd.encode(),
+                ",".join(sorted(all_ips)).encode(),
+                server_ip.encode(),
+            ]),
+            digest_size=16
+        ).digest()
+        with ProxyManager._apply_lock:
+            if digest == ProxyManager._applied_hash:
+                logger.debug("3proxy config unchanged, skipping apply")
+                return True
+
+            self._write_files(config, passwd)
+            # SIGHUP re-reads the config without dropping live connections;
+            # restart only when 3proxy isn't running yet
+            result = self.reload() or self.restart()
+            # Sync iptables PROXYGATE chain with all whitelisted IPs
+            v4_ok = self.sync_iptables_whitelist(all_ips)
+            v6_ok = self.sync_ip6tables_whitelist(all_ips)
+            # A failed firewall sync must be retried on the next apply
+            if result and v4_ok and v6_ok:
+                ProxyManager._applied_hash = digest
+            return result
+
+    @staticmethod
+    def _valid_sources(ips, version: int) -> List[str]:
+        """Keep only well-formed addresses/CIDRs of the given IP version."""
+        sources = []
+        for ip in ips:
+            ip = ip.strip()
+            if not ip:
+                continue
+            try:
+                network = ipaddress.ip_network(ip, strict=False)
+            except ValueError:
+                logger.warning(f"Skipping invalid whitelist entry: {ip!r}")
+                continue
+            if network.version == version:
+                sources.append(ip)
+        return sources
+
+    @staticmethod
+    def _missing_jump_ports(save_cmd: str, chain: str) -> List[str]:
+        """Proxy ports without an INPUT -> chain jump, from one *-save dump."""
+        dump = subprocess.run(
+            [save_cmd, "-t", "filter"],
+            capture_output=True, text=True, check=True
+        ).stdout
+        present = set()
+        for line in dump.splitlines():
+            if line.startswith("-A INPUT ") and line.endswith(f" -j {chain}"):
+                args = line.split()
+                if "--dport" in args:
+                    present.add(args[args.index("--dport") + 1])
+        return [port for port in PROXY_PORTS if port not in present]
 
     @staticmethod
-    def sync_iptables_whitelist(allowed_ips: set) -> None:
+    def _restore_chain(iptables_cmd: str, chain: str, sources: List[str]) -> None:
+        """
+        Replace all rules of a chain in one iptables-restore transaction.
+
+        Emits ACCEPT for every source and a final DROP, plus the INPUT jump
+        rules for proxy ports that are missing. --noflush leaves every other
+        chain untouched.
+        """
+        missing_ports = ProxyManager._missing_jump_ports(f"{iptables_cmd}-save", chain)
+        lines = ["*filter", f":{chain} - [0:0]", f"-F {chain}"]
+        lines.extend(f"-A {chain} -s {ip} -j ACCEPT" for ip in sources)
+        lines.append(f"-A {chain} -j DROP")
+        lines.extend(f"-I INPUT 1 -p tcp --dport {port} -j {chain}" for port in missing_ports)
+        lines.append("COMMIT")
+        subprocess.run(
+            [f"{iptables_cmd}-restore", "--noflush"],
+            input="\n".join(lines) + "\n",
+            text=True, capture_output=True, check=True
+        )
+
+    @staticmethod
+    def sync_iptables_whitelist(allowed_ips: set) -> bool:
         """
         Sync PROXYGATE iptables chain with whitelisted IPs.
 
         Only whitelisted IPs can reach proxy ports (2053/8080/3128/1080/2096).
         Port 443 is NOT filtered — it serves the public web panel + XRay WS.
         This replaces password auth — 3proxy allows 127.0.0.1 without auth.
+        Returns True if the chain was applied.
         """
         chain = "PROXYGATE"
         try:
-            # Ensure chain exists
-            subprocess.run(
-                ["iptables", "-N", chain],
-                capture_output=True
-            )
-            # Flush existing rules
-            subprocess.run(
-                ["iptables", "-F", chain],
-                capture_output=True, check=True
-            )
             # Always allow localhost and server's own IP
-            subprocess.run(
-                ["iptables", "-A", chain, "-s", "127.0.0.1", "-j", "ACCEPT"],
-                capture_output=True, check=True
-            )
-            # Get server IP
+            sources = ["127.0.0.1"]
             try:
-                from app.api.system import get_configured_server_ip
-                server_ip = get_configured_server_ip()
+                server_ip = _configured_server_ip()
                 if server_ip and server_ip != "127.0.0.1":
-                    subprocess.run(
-                        ["iptables", "-A", chain, "-s", server_ip, "-j", "ACCEPT"],
-                        capture_output=True, check=True
-                    )
+                    sources.extend(ProxyManager._valid_sources([server_ip], 4))
             except Exception:
                 pass
             # Add whitelisted IPs
-            for ip in sorted(allowed_ips):
-                ip = ip.strip()
-                if ip and ip != "127.0.0.1":
-                    subprocess.run(
-                        ["iptables", "-A", chain, "-s", ip, "-j", "ACCEPT"],
-                        capture_output=True, check=True
-                    )
-            # Drop all other
-            subprocess.run(
-                ["iptables", "-A", chain, "-j", "DROP"],
-                capture_output=True, check=True
+            sources.extend(
+                ip for ip in ProxyManager._valid_sources(sorted(allowed_ips), 4)
+                if ip != "127.0.0.1"
             )
-            # Ensure chain is referenced from INPUT for proxy ports
-            for port in ["2053", "8080", "3128", "1080", "2096"]:
-                # Check if rule already exists
-                check = subprocess.run(
-                    ["iptables", "-C", "INPUT", "-p", "tcp", "--dport", port, "-j", chain],
-                    capture_output=True
-                )
-                if check.returncode != 0:
-                    subprocess.run(
-                        ["iptables", "-I", "INPUT", "1", "-p", "tcp", "--dport", port, "-j", chain],
-                        capture_output=True, check=True
-                    )
+            # Chain rules and INPUT jumps in a single iptables-restore call
+            ProxyManager._restore_chain("iptables", chain, sources)
             # Save iptables for persistence
-            subprocess.run(
-                "iptables-save > /etc/iptables.rules",
-                shell=True, capture_output=True
-            )
+            with open("/etc/iptables.rules", "wb") as f:
+                subprocess.run(["iptables-save"], stdout=f, stderr=subprocess.DEVNULL)
             logger.info(f"PROXYGATE iptables synced: {len(allowed_ips)} IPs")
+            return True
         except Exception as e:
             logger.error(f"Failed to sync iptables: {e}")
+            return False
 
     @staticmethod
-    def sync_ip6tables_whitelist(allowed_ips: set) -> None:
+    def sync_ip6tables_whitelist(allowed_ips: set) -> bool:
         """
         Sync PROXYGATE ip6tables chain with whitelisted IPv6 addresses.
 
         Mirrors IPv4 version for dual-stack support.
         Ports: 2053/8080/3128/1080/2096 (same as IPv4).
         NOT 443/8443 — public web panel + hidden proxy, auth in 3proxy.
+        Returns True if the chain was applied.
         """
         chain = "PROXYGATE"
         try:
-            # Ensure chain exists
-            subprocess.run(
-                ["ip6tables", "-N", chain],
-                capture_output=True
-            )
-            # Flush existing rules
-            subprocess.run(
-                ["ip6tables", "-F", chain],
-                capture_output=True, check=True
-            )
-            # Always allow localhost
-            subprocess.run(
-                ["ip6tables", "-A", chain, "-s", "::1", "-j", "ACCEPT"],
-                capture_output=True, check=True
-            )
-            # Filter IPv6 addresses from allowed_ips
-            ipv6_ips = [ip.strip() for ip in allowed_ips if ":" in ip.strip()]
-            for ip in sorted(ipv6_ips):
-                if ip and ip != "::1":
-                    subprocess.run(
-                        ["ip6tables", "-A", chain, "-s", ip, "-j", "ACCEPT"],
-                        capture_output=True, check=True
-                    )
-            # Drop all other
-            subprocess.run(
-                ["ip6tables", "-A", chain, "-j", "DROP"],
-                capture_output=True, check=True
-            )
-            # Ensure chain is referenced from INPUT for proxy ports
-            for port in ["2053", "8080", "3128", "1080", "2096"]:
-                check = subprocess.run(
-                    ["ip6tables", "-C", "INPUT", "-p", "tcp", "--dport", port, "-j", chain],
-                    capture_output=True
-                )
-                if check.returncode != 0:
-                    subprocess.run(
-                        ["ip6tables", "-I", "INPUT", "1", "-p", "tcp", "--dport", port, "-j", chain],
-                        capture_output=True, check=True
-                    )
+            # Always allow localhost, then IPv6 addresses from allowed_ips
+            ipv6_ips = [
+                ip for ip in ProxyManager._valid_sources(sorted(allowed_ips), 6)
+                if ip != "::1"
+            ]
+            ProxyManager._restore_chain("ip6tables", chain, ["::1"] + ipv6_ips)
             # Save ip6tables for persistence
-            subprocess.run(
-                "ip6tables-save > /etc/ip6tables.rules",
-                shell=True, capture_output=True
-            )
+            with open("/etc/ip6tables.rules", "wb") as f:
+                subprocess.run(["ip6tables-save"], stdout=f, stderr=subprocess.DEVNULL)
             logger.info(f"PROXYGATE ip6tables synced: {len(ipv6_ips)} IPv6 IPs")
+            return True
         except Exception as e:
             logger.error(f"Failed to sync ip6tables: {e}")
+            return False
 
 
 async def rebuild_proxy_config(db):
     """Load all active clients with proxy accounts and rebuild 3proxy config."""
+    import asyncio
     from sqlalchemy import select
-    from sqlalchemy.orm import selectinload
-    from app.models import Client
+    from app.models import Client, ClientDomain, ProxyAccount
+    from app.models.proxy import split_allowed_ips
 
+    # Flat join returning plain Row tuples - one row per (account, domain),
+    # no ORM identity map or instrumented attribute access
     result = await db.execute(
-        select(Client)
-        .options(
-            selectinload(Client.proxy_account),
-            selectinload(Client.domains),
+        select(
+            ProxyAccount.id,
+            ProxyAccount.username,
+            ProxyAccount.password_plain,
+            ProxyAccount.allowed_ips,
+            ClientDomain.domain,
+            ClientDomain.include_subdomains,
         )
-        .where(Client.is_active == True)
+        .join(Client, Client.id == ProxyAccount.client_id)
+        .outerjoin(
+            ClientDomain,
+            (ClientDomain.client_id == Client.id) & (ClientDomain.is_active == True),
+        )
+        .where(Client.is_active == True, ProxyAccount.is_active == True)
+        .order_by(ProxyAccount.id, ClientDomain.id)
     )
-    clients = result.scalars().all()
-
-    proxy_clients = []
-    for client in clients:
-        if client.proxy_account and client.proxy_account.is_active:
-            allowed_ips = []
-            if client.proxy_account.allowed_ips:
-                allowed_ips = [
-                    ip.strip()
-                    for ip in client.proxy_account.allowed_ips.split(",")
-                    if ip.strip()
-                ]
-            proxy_clients.append(ProxyClient(
-                username=client.proxy_account.username,
-                password=client.proxy_account.password_plain,
-                domains=[
-                    ProxyDomain(domain=d.domain, include_subdomains=d.include_subdomains)
-                    for d in client.domains if d.is_active
-                ],
+
+    proxy_clients = {}
+    for account_id, username, password, allowed_ips_raw, domain, include_subdomains in result:
+        proxy_client = proxy_clients.get(account_id)
+        if proxy_client is None:
+            proxy_client = proxy_clients[account_id] = ProxyClient(
+                username=username,
+                password=password,
+                domains=[],
                 is_active=True,
-                allowed_ips=allowed_ips,
-            ))
+                allowed_ips=list(split_allowed_ips(allowed_ips_raw)),
+            )
+        if domain is not None:
+            proxy_client.domains.append(
+                ProxyDomain(domain=domain, include_subdomains=include_subdomains)
+            )
 
-    ProxyManager().apply_changes(proxy_clients)
+    # File writes, reload and iptables calls block - keep them off the event loop
+    await asyncio.to_thread(ProxyManager().apply_changes, list(proxy_clients.values()))
@@ -1,26 +1,312 @@
 """
 Security service for brute force protection
 """
-from datetime import datetime, timedelta
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
 from typing import Optional
-from sqlalchemy import select, func, delete
+from sqlalchemy import select, insert, update, func, delete, or_, case, tuple_, text, lambda_stmt
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.models.security import FailedLogin, BlockedIP, SecurityEvent
+from app.models.security import FailedLogin, BlockedIP, SecurityEvent, utcnow
 from app.config import settings
 
+logger = logging.getLogger(__name__)
+
+
+# Active blocklist kept in memory so the common "not blocked" answer needs no
+# DB round-trip: IP -> blocked_until as epoch seconds (None for permanent
+# blocks), so the expiry check is a float compare against time.time().
+# Updated in place on block/unblock and re-read from the DB every
+# BLOCKLIST_REFRESH_SECONDS to pick up changes made elsewhere (less often
+# while the PostgreSQL change listener below is connected).
+BLOCKLIST_REFRESH_SECONDS = 60
+_blocked_ips: dict[str, Optional[float]] = {}
+_blocked_ips_loaded_at: Optional[int] = None
+
+
+def _expiry_ts(is_permanent: Optional[bool], blocked_until: Optional[datetime]) -> Optional[float]:
+    """Epoch seconds of a naive-UTC blocked_until; None if the block never ends"""
+    if is_permanent or blocked_until is None:
+        return None
+    return blocked_until.replace(tzinfo=timezone.utc).timestamp()
+
+
+def _mark_blocked(block: BlockedIP) -> None:
+    _blocked_ips[block.ip_address] = _expiry_ts(block.is_permanent, block.blocked_until)
+    _recent_block_rows.pop(block.ip_address, None)
+    _blocked_count_cache.clear()
+
+
+def _mark_unblocked(ip_address: str) -> None:
+    _blocked_ips.pop(ip_address, None)
+    _recent_block_rows.pop(ip_address, None)
+    _blocked_count_cache.clear()
+
+
+# Blocked IPs hammering the login endpoints: concurrent checks for one IP share
+# a single row lookup, and a positive answer is reused for a second.
+BLOCK_ROW_TTL_SECONDS = 1
+_recent_block_rows: dict[str, tuple[int, BlockedIP]] = {}
+_inflight: dict[str, asyncio.Future] = {}
+
+
+async def _coalesced(key: str, load):
+    """Run load() once for concurrent callers with the same key; all get its result"""
+    while (inflight := _inflight.get(key)) is not None:
+        try:
+            return await asyncio.shield(inflight)
+        except asyncio.CancelledError:
+            # Only the loading caller was cancelled: run the load ourselves
+            if not inflight.cancelled():
+                raise
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        value = await load()
+    except asyncio.CancelledError:
+        # Our caller went away; waiters retry instead of inheriting it
+        future.cancel()
+        raise
+    except BaseException as e:
+        future.set_exception(e)
+        future.exception()  # waiters re-raise it; don't warn if there are none
+        raise
+    finally:
+        del _inflight[key]
+    future.set_result(value)
+    return value
+
+
+# Blocked-IP counts: (active_only, estimate) -> (expires at monotonic_ns, count).
+# Short TTL, and cleared by every block/unblock above.
+BLOCKED_COUNT_TTL_SECONDS = 10
+_blocked_count_cache: dict[tuple[bool, bool], tuple[int, int]] = {}
+
+
+# INSERT constructs with ON CONFLICT support, by engine dialect
+_dialect_insert = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+
+def _active_block_stmt(ip_address: str):
+    """Active BlockedIP row for an IP; lambda_stmt caches construction and SQL"""
+    return lambda_stmt(
+        lambda: select(BlockedIP).where(
+            BlockedIP.ip_address == ip_address,
+            BlockedIP.is_active == True
+        )
+    )
+
+
+# Failed attempts this process has queued for the background writer but not
+# yet written, per IP. The block decision counts failed_logins rows (written
+# by any process, API or cron) plus these.
+_queued_failures: dict[str, int] = {}
+
+
+# Failed-login rows and their "login_failed" events are written off the
+# request path: record_failed_attempt enqueues them and a single writer task
+# inserts them in batches. The bounded queue makes callers wait during a
+# flood instead of buffering without limit.
+FAILURE_QUEUE_SIZE = 10_000
+FAILURE_BATCH_SIZE = 500
+_failure_queue: Optional[asyncio.Queue] = None
+_failure_writer: Optional[asyncio.Task] = None
+# Notified after every batch, for callers waiting on an IP's queued rows
+_failures_written: Optional[asyncio.Condition] = None
+
+
+async def _write_failures(batch: list[tuple[dict, dict]]) -> None:
+    from app.database import async_session_maker
+
+    async with async_session_maker() as db:
+        await db.execute(insert(FailedLogin), [attempt for attempt, _ in batch])
+        await db.execute(insert(SecurityEvent), [event for _, event in batch])
+        await db.commit()
+
+
+async def _failure_writer_loop(queue: asyncio.Queue, written: asyncio.Condition) -> None:
+    while True:
+        batch = [await queue.get()]
+        while len(batch) < FAILURE_BATCH_SIZE and not queue.empty():
+            batch.append(queue.get_nowait())
+        try:
+            await _write_failures(batch)
+        except Exception:
+            logger.exception("Failed to write %d failed login attempts", len(batch))
+        finally:
+            for attempt, _ in batch:
+                ip_address = attempt["ip_address"]
+                if _queued_failures[ip_address] > 1:
+                    _queued_failures[ip_address] -= 1
+                else:
+                    del _queued_failures[ip_address]
+                queue.task_done()
+            async with written:
+                written.notify_all()
+
+
+async def _wait_for_queued_failures(ip_address: str) -> None:
+    """Wait until the failed attempts queued for an IP have been written"""
+    if _queued_failures.get(ip_address):
+        async with _failures_written:
+            await _failures_written.wait_for(lambda: ip_address not in _queued_failures)
+
+
+def start_failure_writer() -> None:
+    """Start the background writer for failed login attempts"""
+    global _failure_queue, _failure_writer, _failures_written
+    _failure_queue = asyncio.Queue(maxsize=FAILURE_QUEUE_SIZE)
+    _failures_written = asyncio.Condition()
+    _failure_writer = asyncio.create_task(_failure_writer_loop(_failure_queue, _failures_written))
+
+
+async def stop_failure_writer() -> None:
+    """Write out queued failed attempts and stop the writer"""
+    global _failure_queue, _failure_writer, _failures_written
+    if _failure_writer is None:
+        return
+    await _failure_queue.join()
+    _failure_writer.cancel()
+    try:
+        await _failure_writer
+    except asyncio.CancelledError:
+        pass
+    _failure_queue = _failure_writer = _failures_written = None
+
+
+# On PostgreSQL a trigger on blocked_ips (migration 013) sends the IP of every
+# changed row on this channel. While we are listening, those rows are re-read
+# as they change and the full blocklist reload can run much less often.
+BLOCKLIST_CHANNEL = "blocked_ips_changed"
+BLOCKLIST_LISTEN_REFRESH_SECONDS = 600
+BLOCKLIST_LISTEN_RETRY_SECONDS = 5
+_blocklist_listening = False
+_blocklist_listener: Optional[asyncio.Task] = None
+_notify_tasks: set[asyncio.Task] = set()
+
+
+def _blocklist_max_age_ns() -> int:
+    seconds = BLOCKLIST_LISTEN_REFRESH_SECONDS if _blocklist_listening else BLOCKLIST_REFRESH_SECONDS
+    return seconds * 1_000_000_000
+
+
+async def _refresh_blocked_ip(ip_address: str) -> None:
+    from app.database import async_session_maker
+
+    async with async_session_maker() as db:
+        block = (await db.execute(_active_block_stmt(ip_address))).scalar_one_or_none()
+    if block is None:
+        _mark_unblocked(ip_address)
+    else:
+        _mark_blocked(block)
+
+
+def _on_blocklist_notify(connection, pid, channel, ip_address) -> None:
+    task = asyncio.get_running_loop().create_task(
+        _coalesced(f"notify:{ip_address}", lambda: _refresh_blocked_ip(ip_address))
+    )
+    _notify_tasks.add(task)
+    task.add_done_callback(_notify_tasks.discard)
+
+
+async def _blocklist_listen_loop(engine) -> None:
+    global _blocklist_listening, _blocked_ips_loaded_at
+    while True:
+        try:
+            async with engine.connect() as conn:
+                driver = (await conn.get_raw_connection()).driver_connection
+                lost = asyncio.Event()
+                driver.add_termination_listener(lambda _: lost.set())
+                await driver.add_listener(BLOCKLIST_CHANNEL, _on_blocklist_notify)
+                # Changes made while we weren't listening are only in the DB
+                _blocked_ips_loaded_at = None
+                _blocklist_listening = True
+                try:
+                    await lost.wait()
+                finally:
+                    _blocklist_listening = False
+                await conn.invalidate()
+            logger.warning("Blocklist listener connection lost, reconnecting")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Blocklist listener failed: %s", e)
+        await asyncio.sleep(BLOCKLIST_LISTEN_RETRY_SECONDS)
+
+
+def start_blocklist_listener() -> None:
+    """Listen for blocked_ips changes on PostgreSQL; no-op on other databases"""
+    global _blocklist_listener
+    from app.database import engine
+
+    if engine.dialect.name == "postgresql":
+        _blocklist_listener = asyncio.create_task(_blocklist_listen_loop(engine))
+
+
+async def stop_blocklist_listener() -> None:
+    global _blocklist_listener
+    if _blocklist_listener is None:
+        return
+    _blocklist_listener.cancel()
+    try:
+        await _blocklist_listener
+    except asyncio.CancelledError:
+        pass
+    _blocklist_listener = None
+
+
+def _failure_rows(
+    ip_address: str,
+    username: Optional[str] = None,
+    endpoint: str = "/api/auth/login",
+    user_agent: Optional[str] = None
+) -> tuple[dict, dict]:
+    """failed_logins row and "login_failed" security event for one attempt"""
+    attempt = {
+        "ip_address": ip_address,
+        "username": username,
+        "endpoint": endpoint,
+        "user_agent": user_agent,
+    }
+    event = {
+        "event_type": "login_failed",
+        "ip_address": ip_address,
+        "username": username,
+        "details": f"Failed login attempt on {endpoint}",
+    }
+    return attempt, event
+
 
 class SecurityService:
-    """Handles brute force protection and security events"""
+    """
+    Handles brute force protection and security events.
+
+    Failed attempts are written by a background writer. Blocking and
+    auto-unblock commit themselves, since their callers raise right after
+    and the request session would roll back. Admin block/unblock commit
+    too, before touching the in-memory blocklist. Successful logins only
+    flush and leave the commit to the request-scoped get_db session.
+    cleanup_old_records commits per batch.
+    """
 
     # Configuration
     MAX_FAILED_ATTEMPTS = 5  # Block after this many failures
     BLOCK_DURATION_MINUTES = 30  # Temporary block duration
     ATTEMPT_WINDOW_MINUTES = 15  # Count attempts within this window
     PERMANENT_BLOCK_THRESHOLD = 3  # Permanent block after this many temp blocks
+    CLEANUP_BATCH_SIZE = 10_000  # Rows per DELETE in cleanup_old_records
 
     def __init__(self, db: AsyncSession):
         self.db = db
+        # Security events queued by _log_event, written in one batch on flush
+        self._pending_events: list[dict] = []
 
     async def record_failed_attempt(
         self,
@@ -32,125 +318,255 @@ class SecurityService:
         """
         Record a failed login attempt and check if IP should be blocked.
         Returns BlockedIP if the IP was blocked, None otherwise.
-        """
-        # Record the failed attempt
-        failed_login = FailedLogin(
-            ip_address=ip_address,
-            username=username,
-            endpoint=endpoint,
-            user_agent=user_agent
-        )
-        self.db.add(failed_login)
 
-        # Log security event
-        await self._log_event(
-            "login_failed",
-            ip_address=ip_address,
-            username=username,
-            details=f"Failed login attempt on {endpoint}"
-        )
+        The attempt row and its event go to the background writer; without
+        a running writer (scripts) they are written inline.
+        """
+        # Earlier failures from this IP within the window
+        attempt_count = (await self._recent_failure_counts([ip_address]))[ip_address]
 
-        # Count recent failed attempts from this IP
-        window_start = datetime.utcnow() - timedelta(minutes=self.ATTEMPT_WINDOW_MINUTES)
-        result = await self.db.execute(
-            select(func.count(FailedLogin.id))
-            .where(FailedLogin.ip_address == ip_address)
-            .where(FailedLogin.attempt_time >= window_start)
-        )
-        attempt_count = result.scalar() or 0
+        attempt, event = _failure_rows(ip_address, username, endpoint, user_agent)
+        if _failure_queue is not None:
+            _queued_failures[ip_address] = _queued_failures.get(ip_address, 0) + 1
+            await _failure_queue.put((attempt, event))
+        else:
+            await self.db.execute(insert(FailedLogin), [attempt])
+            self._pending_events.append(event)
 
         # Check if we should block
         if attempt_count >= self.MAX_FAILED_ATTEMPTS:
             return await self._block_ip(ip_address, attempt_count)
 
-        await self.db.commit()
+        if _failure_queue is None:
+            await self._commit()
         return None
 
-    async def _block_ip(self, ip_address: str, failed_attempts: int) -> BlockedIP:
-        """Block an IP address"""
-        # Check if already blocked
-        result = await self.db.execute(
-            select(BlockedIP).where(
-                BlockedIP.ip_address == ip_address,
-                BlockedIP.is_active == True
-            )
-        )
-        existing_block = result.scalar_one_or_none()
-
-        if existing_block:
-            # Update existing block
-            existing_block.failed_attempts += failed_attempts
-            existing_block.blocked_at = datetime.utcnow()
-
-            # Check if should become permanent
-            if existing_block.failed_attempts >= self.MAX_FAILED_ATTEMPTS * self.PERMANENT_BLOCK_THRESHOLD:
-                existing_block.is_permanent = True
-                existing_block.blocked_until = None
-                existing_block.reason = "Permanent block: repeated brute force attempts"
-            else:
-                existing_block.blocked_until = datetime.utcnow() + timedelta(minutes=self.BLOCK_DURATION_MINUTES)
+    async def record_failed_attempts(self, attempts: list[dict]) -> dict[str, BlockedIP]:
+        """
+        record_failed_attempt for a batch of attempts (dicts with its keyword
+        arguments), in order, e.g. parsed from a log.
 
-            await self._log_event(
-                "ip_block_extended",
-                ip_address=ip_address,
-                details=f"Block extended. Total attempts: {existing_block.failed_attempts}"
+        All attempt rows and their events go out in one multi-row INSERT each,
+        and an IP's later attempts are dropped once it gets blocked.
+        Returns the resulting blocks by IP.
+        """
+        counts = await self._recent_failure_counts({a["ip_address"] for a in attempts})
+        rows, events = [], []
+        to_block: dict[str, int] = {}
+        for attempt in attempts:
+            ip_address = attempt["ip_address"]
+            if ip_address in to_block:
+                continue
+            row, event = _failure_rows(**attempt)
+            rows.append(row)
+            events.append(event)
+            attempt_count = counts[ip_address]
+            counts[ip_address] += 1
+            if attempt_count >= self.MAX_FAILED_ATTEMPTS:
+                to_block[ip_address] = attempt_count
+
+        if rows:
+            await self.db.execute(insert(FailedLogin), rows)
+            self._pending_events.extend(events)
+
+        blocks = {}
+        for ip_address, attempt_count in to_block.items():
+            blocks[ip_address] = await self._block_ip(ip_address, attempt_count)
+        await self._commit()
+        return blocks
+
+    async def _recent_failure_counts(self, ip_addresses) -> dict[str, int]:
+        """
+        Failed attempts per IP within the window: failed_logins rows from
+        every process, plus ones still queued here for the writer. Each
+        per-IP scan stops after MAX_FAILED_ATTEMPTS + 1 rows.
+        """
+        window_start = datetime.utcnow() - timedelta(minutes=self.ATTEMPT_WINDOW_MINUTES)
+        counts = {}
+        for ip_address in ip_addresses:
+            recent = (
+                select(FailedLogin.id)
+                .where(FailedLogin.ip_address == ip_address)
+                .where(FailedLogin.attempt_time >= window_start)
+                .limit(self.MAX_FAILED_ATTEMPTS + 1)
+                .subquery()
             )
+            result = await self.db.execute(select(func.count()).select_from(recent))
+            counts[ip_address] = result.scalar() + _queued_failures.get(ip_address, 0)
+        return counts
 
-            await self.db.commit()
-            return existing_block
+    async def _block_ip(self, ip_address: str, failed_attempts: int) -> BlockedIP:
+        """
+        Block an IP address, or extend its active block.
 
-        # Create new block
-        blocked_ip = BlockedIP(
+        One INSERT ... ON CONFLICT (ip_address) DO UPDATE: an active block
+        accumulates attempts (and turns permanent past the threshold), an
+        old inactive row for the IP is reused as a fresh block.
+        """
+        # blocked_until stays app-side: the in-memory blocklist compares it
+        # against this process's clock
+        blocked_until = datetime.utcnow() + timedelta(minutes=self.BLOCK_DURATION_MINUTES)
+        stmt = _dialect_insert[self.db.get_bind().dialect.name](BlockedIP).values(
             ip_address=ip_address,
             reason=f"Too many failed login attempts ({failed_attempts} attempts)",
             failed_attempts=failed_attempts,
-            blocked_until=datetime.utcnow() + timedelta(minutes=self.BLOCK_DURATION_MINUTES),
-            is_permanent=False
+            blocked_until=blocked_until,
+            is_permanent=False,
+            is_active=True
         )
-        self.db.add(blocked_ip)
-
-        await self._log_event(
-            "ip_blocked",
-            ip_address=ip_address,
-            details=f"IP blocked for {self.BLOCK_DURATION_MINUTES} minutes after {failed_attempts} failed attempts"
+        was_active = BlockedIP.is_active == True
+        total = case(
+            (was_active, BlockedIP.failed_attempts + stmt.excluded.failed_attempts),
+            else_=stmt.excluded.failed_attempts
         )
+        permanent = total >= self.MAX_FAILED_ATTEMPTS * self.PERMANENT_BLOCK_THRESHOLD
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[BlockedIP.ip_address],
+            set_={
+                "failed_attempts": total,
+                "blocked_at": utcnow(),
+                "is_permanent": case(
+                    (permanent, True), (was_active, BlockedIP.is_permanent), else_=False
+                ),
+                "blocked_until": case((permanent, None), else_=blocked_until),
+                "reason": case(
+                    (permanent, "Permanent block: repeated brute force attempts"),
+                    (was_active, BlockedIP.reason),
+                    else_=stmt.excluded.reason
+                ),
+                "is_active": True,
+                "unblocked_at": case((was_active, BlockedIP.unblocked_at), else_=None),
+                "unblocked_by": case((was_active, BlockedIP.unblocked_by), else_=None),
+                "notes": case((was_active, BlockedIP.notes), else_=None),
+            }
+        ).returning(BlockedIP)
+        result = await self.db.execute(
+            stmt, execution_options={"populate_existing": True}
+        )
+        block = result.scalar_one()
 
-        await self.db.commit()
-        return blocked_ip
+        if block.failed_attempts > failed_attempts:
+            await self._log_event(
+                "ip_block_extended",
+                ip_address=ip_address,
+                details=f"Block extended. Total attempts: {block.failed_attempts}"
+            )
+        else:
+            await self._log_event(
+                "ip_blocked",
+                ip_address=ip_address,
+                details=f"IP blocked for {self.BLOCK_DURATION_MINUTES} minutes after {failed_attempts} failed attempts"
+            )
 
-    async def is_ip_blocked(self, ip_address: str) -> tuple[bool, Optional[BlockedIP]]:
-        """Check if an IP is currently blocked"""
+        await self._commit()
+        _mark_blocked(block)
+        return block
+
+    async def _get_blocked_ips(self) -> dict[str, Optional[float]]:
+        """Active blocklist, reloaded from the DB when the cached copy is stale"""
+        if (
+            _blocked_ips_loaded_at is None
+            or time.monotonic_ns() - _blocked_ips_loaded_at > _blocklist_max_age_ns()
+        ):
+            await _coalesced("blocklist", self._load_blocked_ips)
+        return _blocked_ips
+
+    async def _load_blocked_ips(self) -> None:
+        global _blocked_ips, _blocked_ips_loaded_at
+        now = time.monotonic_ns()
+        # Skip temporary blocks that already ran out so they don't cost a
+        # row lookup on every check until someone hits them
         result = await self.db.execute(
-            select(BlockedIP).where(
-                BlockedIP.ip_address == ip_address,
-                BlockedIP.is_active == True
+            select(
+                BlockedIP.ip_address, BlockedIP.is_permanent, BlockedIP.blocked_until
+            ).where(
+                BlockedIP.is_active == True,
+                or_(
+                    BlockedIP.is_permanent == True,
+                    BlockedIP.blocked_until.is_(None),
+                    BlockedIP.blocked_until > datetime.utcnow(),
+                )
             )
         )
+        _blocked_ips = {
+            ip: _expiry_ts(is_permanent, blocked_until)
+            for ip, is_permanent, blocked_until in result
+        }
+        _blocked_ips_loaded_at = now
+
+    async def is_ip_blocked(self, ip_address: str) -> tuple[bool, Optional[BlockedIP]]:
+        """Check if an IP is currently blocked"""
+        blocked_ips = await self._get_blocked_ips()
+        if ip_address not in blocked_ips:
+            return False, None
+
+        # Known-expired temporary block: deactivate it without reading the row
+        expires_at = blocked_ips[ip_address]
+        if expires_at is not None and time.time() > expires_at:
+            if await self._expire_block(ip_address):
+                return False, None
+
+        recent = _recent_block_rows.get(ip_address)
+        if recent and recent[0] > time.monotonic_ns():
+            return True, recent[1]
+
+        answer = await _coalesced(
+            f"block:{ip_address}", lambda: self._lookup_block(ip_address)
+        )
+        if answer[0]:
+            _recent_block_rows[ip_address] = (
+                time.monotonic_ns() + BLOCK_ROW_TTL_SECONDS * 1_000_000_000, answer[1]
+            )
+        return answer
+
+    async def _lookup_block(self, ip_address: str) -> tuple[bool, Optional[BlockedIP]]:
+        """Read the active block row for an IP listed in the blocklist"""
+        result = await self.db.execute(_active_block_stmt(ip_address))
         block = result.scalar_one_or_none()
 
         if not block:
+            _mark_unblocked(ip_address)
             return False, None
 
         # Check if temporary block has expired
         if not block.is_permanent and block.blocked_until:
             if datetime.utcnow() > block.blocked_until:
-                # Auto-unblock expired temporary blocks
-                block.is_active = False
-                block.unblocked_at = datetime.utcnow()
-                block.notes = "Auto-unblocked: temporary block expired"
-                await self.db.commit()
+                await self._expire_block(ip_address)
                 return False, None
 
         return True, block
 
-    async def unblock_ip(self, ip_address: str, admin_username: str, notes: Optional[str] = None) -> bool:
-        """Manually unblock an IP"""
+    async def _expire_block(self, ip_address: str) -> bool:
+        """
+        Auto-unblock an expired temporary block in one conditional UPDATE.
+
+        The WHERE clause re-checks expiry, so concurrent requests from the
+        same IP deactivate it once. Returns False if no row was expired.
+        """
         result = await self.db.execute(
-            select(BlockedIP).where(
+            update(BlockedIP)
+            .where(
                 BlockedIP.ip_address == ip_address,
-                BlockedIP.is_active == True
+                BlockedIP.is_active == True,
+                BlockedIP.is_permanent.isnot(True),
+                BlockedIP.blocked_until < datetime.utcnow()
+            )
+            .values(
+                is_active=False,
+                unblocked_at=utcnow(),
+                notes="Auto-unblocked: temporary block expired"
             )
+            .returning(BlockedIP.id)
         )
+        if result.first() is None:
+            return False
+        await self._commit()
+        _mark_unblocked(ip_address)
+        return True
+
+    async def unblock_ip(self, ip_address: str, admin_username: str, notes: Optional[str] = None) -> bool:
+        """Manually unblock an IP"""
+        result = await self.db.execute(_active_block_stmt(ip_address))
         block = result.scalar_one_or_none()
 
         if not block:
@@ -168,7 +584,10 @@ class SecurityService:
             details=f"IP unblocked by admin: {notes or 'No reason provided'}"
         )
 
-        await self.db.commit()
+        # Committed before the in-memory blocklist changes, so a rollback
+        # can't leave the two disagreeing
+        await self._commit()
+        _mark_unblocked(ip_address)
         return True
 
     async def block_ip_manually(
@@ -181,12 +600,7 @@ class SecurityService:
     ) -> BlockedIP:
         """Manually block an IP (by admin)"""
         # Check if already blocked
-        result = await self.db.execute(
-            select(BlockedIP).where(
-                BlockedIP.ip_address == ip_address,
-                BlockedIP.is_active == True
-            )
-        )
+        result = await self.db.execute(_active_block_stmt(ip_address))
         existing = result.scalar_one_or_none()
 
         if existing:
@@ -197,7 +611,8 @@ class SecurityService:
             else:
                 existing.blocked_until = None
             existing.notes = f"Manually blocked by {admin_username}"
-            await self.db.commit()
+            await self._commit()
+            _mark_blocked(existing)
             return existing
 
         blocked_until = None
@@ -220,44 +635,87 @@ class SecurityService:
             details=f"Manually blocked: {reason}"
         )
 
-        await self.db.commit()
+        await self._commit()
+        _mark_blocked(blocked_ip)
         return blocked_ip
 
     async def get_blocked_ips(
         self,
         active_only: bool = True,
         limit: int = 100,
-        offset: int = 0
+        offset: int = 0,
+        after: Optional[tuple[datetime, int]] = None
     ) -> list[BlockedIP]:
-        """Get list of blocked IPs"""
-        query = select(BlockedIP).order_by(BlockedIP.blocked_at.desc())
+        """
+        Get list of blocked IPs, newest first.
+
+        after: (blocked_at, id) of the last row of the previous page; keyset
+        pagination that replaces offset and stays O(limit) at any depth.
+        """
+        query = select(BlockedIP).order_by(BlockedIP.blocked_at.desc(), BlockedIP.id.desc())
 
         if active_only:
             query = query.where(BlockedIP.is_active == True)
 
-        query = query.limit(limit).offset(offset)
+        if after:
+            query = query.where(tuple_(BlockedIP.blocked_at, BlockedIP.id) < after)
+        elif offset:
+            query = query.offset(offset)
+
+        query = query.limit(limit)
         result = await self.db.execute(query)
         return list(result.scalars().all())
 
-    async def get_blocked_ip_count(self, active_only: bool = True) -> int:
-        """Get count of blocked IPs"""
-        query = select(func.count(BlockedIP.id))
-        if active_only:
-            query = query.where(BlockedIP.is_active == True)
-        result = await self.db.execute(query)
-        return result.scalar() or 0
+    async def get_blocked_ip_count(self, active_only: bool = True, estimate: bool = False) -> int:
+        """
+        Get count of blocked IPs (cached for BLOCKED_COUNT_TTL_SECONDS).
+
+        estimate=True lets the all-time count on PostgreSQL come from the
+        planner's row estimate, which avoids scanning an ever-growing table
+        on every dashboard poll. It lags behind ANALYZE, so anything that
+        pages through the list must use the exact count.
+        """
+        now = time.monotonic_ns()
+        key = (active_only, estimate)
+        cached = _blocked_count_cache.get(key)
+        if cached and cached[0] > now:
+            return cached[1]
+
+        count = None
+        if estimate and not active_only and self.db.get_bind().dialect.name == "postgresql":
+            result = await self.db.execute(
+                text("SELECT reltuples::bigint FROM pg_class WHERE oid = 'blocked_ips'::regclass")
+            )
+            count = result.scalar()
+            # -1 until the table has been analyzed (0 on PostgreSQL <= 13)
+            if count is not None and count <= 0:
+                count = None
+
+        if count is None:
+            query = select(func.count(BlockedIP.id))
+            if active_only:
+                query = query.where(BlockedIP.is_active == True)
+            result = await self.db.execute(query)
+            count = result.scalar() or 0
+
+        _blocked_count_cache[key] = (now + BLOCKED_COUNT_TTL_SECONDS * 1_000_000_000, count)
+        return count
 
     async def get_recent_failed_attempts(
         self,
         ip_address: Optional[str] = None,
-        limit: int = 100
+        limit: int = 100,
+        after: Optional[tuple[datetime, int]] = None
     ) -> list[FailedLogin]:
-        """Get recent failed login attempts"""
-        query = select(FailedLogin).order_by(FailedLogin.attempt_time.desc())
+        """Get recent failed login attempts (after: (attempt_time, id) keyset)"""
+        query = select(FailedLogin).order_by(FailedLogin.attempt_time.desc(), FailedLogin.id.desc())
 
         if ip_address:
             query = query.where(FailedLogin.ip_address == ip_address)
 
+        if after:
+            query = query.where(tuple_(FailedLogin.attempt_time, FailedLogin.id) < after)
+
         query = query.limit(limit)
         result = await self.db.execute(query)
         return list(result.scalars().all())
@@ -265,21 +723,27 @@ class SecurityService:
     async def get_security_events(
         self,
         event_type: Optional[str] = None,
-        limit: int = 100
+        limit: int = 100,
+        after: Optional[tuple[datetime, int]] = None
     ) -> list[SecurityEvent]:
-        """Get security events log"""
-        query = select(SecurityEvent).order_by(SecurityEvent.created_at.desc())
+        """Get security events log (after: (created_at, id) keyset)"""
+        query = select(SecurityEvent).order_by(SecurityEvent.created_at.desc(), SecurityEvent.id.desc())
 
         if event_type:
             query = query.where(SecurityEvent.event_type == event_type)
 
+        if after:
+            query = query.where(tuple_(SecurityEvent.created_at, SecurityEvent.id) < after)
+
         query = query.limit(limit)
         result = await self.db.execute(query)
         return list(result.scalars().all())
 
     async def record_successful_login(self, ip_address: str, username: str):
         """Record successful login (clears failed attempts for this IP)"""
-        # Clear recent failed attempts
+        # Clear recent failed attempts, including ones still queued for the
+        # writer: those rows would otherwise land after the DELETE
+        await _wait_for_queued_failures(ip_address)
         window_start = datetime.utcnow() - timedelta(minutes=self.ATTEMPT_WINDOW_MINUTES)
         await self.db.execute(
             delete(FailedLogin).where(
@@ -295,20 +759,31 @@ class SecurityService:
             details="Successful login"
         )
 
-        await self.db.commit()
+        await self._flush()
 
     async def cleanup_old_records(self, days: int = 30):
         """Clean up old failed login records and events"""
         cutoff = datetime.utcnow() - timedelta(days=days)
 
-        await self.db.execute(
-            delete(FailedLogin).where(FailedLogin.attempt_time < cutoff)
-        )
-        await self.db.execute(
-            delete(SecurityEvent).where(SecurityEvent.created_at < cutoff)
-        )
+        await self._delete_in_batches(FailedLogin, FailedLogin.attempt_time < cutoff)
+        await self._delete_in_batches(SecurityEvent, SecurityEvent.created_at < cutoff)
 
-        await self.db.commit()
+    async def _delete_in_batches(self, model, condition):
+        """
+        DELETE matching rows CLEANUP_BATCH_SIZE at a time, committing after
+        each batch so locks and WAL per transaction stay bounded.
+        """
+        while True:
+            batch = select(model.id).where(condition).limit(self.CLEANUP_BATCH_SIZE)
+            result = await self.db.execute(
+                delete(model).where(model.id.in_(batch.scalar_subquery())),
+                execution_options={"synchronize_session": False}
+            )
+            await self._commit()
+            if result.rowcount < self.CLEANUP_BATCH_SIZE:
+                break
+            # Let concurrent auth traffic and autovacuum in between batches
+            await asyncio.sleep(0.1)
 
     async def _log_event(
         self,
@@ -317,14 +792,24 @@ class SecurityService:
         username: Optional[str] = None,
         details: Optional[str] = None
     ):
-        """Log a security event"""
-        event = SecurityEvent(
-            event_type=event_type,
-            ip_address=ip_address,
-            username=username,
-            details=details
-        )
-        self.db.add(event)
+        """Queue a security event; written by the next _flush()/_commit()"""
+        self._pending_events.append({
+            "event_type": event_type,
+            "ip_address": ip_address,
+            "username": username,
+            "details": details,
+        })
+
+    async def _flush(self):
+        """Write queued security events in one executemany INSERT and flush"""
+        if self._pending_events:
+            events, self._pending_events = self._pending_events, []
+            await self.db.execute(insert(SecurityEvent), events)
+        await self.db.flush()
+
+    async def _commit(self):
+        await self._flush()
+        await self.db.commit()
 
 
 # Dependency for FastAPI
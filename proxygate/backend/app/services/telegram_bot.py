@@ -1,8 +1,37 @@
-from typing import Optional
+from typing import List, Optional, Tuple, Union
 import asyncio
+import logging
+import os
 
 from app.config import settings
 
+logger = logging.getLogger(__name__)
+
+
+# Message templates (str.format)
+_PAYMENT_REMINDER_TEMPLATE = """
+<b>ProxyGate VPN</b>
+
+{client_name}, ваша подписка истекает через {days_left} дней!
+
+Для продления обратитесь к администратору.
+"""
+
+_NEW_CLIENT_TEMPLATE = """
+<b>Новый клиент</b>
+
+Имя: {client_name}
+Логин: {username}
+"""
+
+_DOMAIN_REQUEST_TEMPLATE = """
+<b>Запрос на добавление домена</b>
+
+Клиент: {client_name}
+Домен: {domain}
+Причина: {reason}
+"""
+
 
 class TelegramNotifier:
     """
@@ -11,27 +40,60 @@ class TelegramNotifier:
     Sends notifications to admin and clients.
     """
 
+    # Concurrent sends for bulk notifications
+    BULK_SEND_CONCURRENCY = 20
+
     def __init__(self):
         self.bot = None
-        self._initialized = False
+        # No token configured: every send returns False before doing any work
+        self._enabled = bool(settings.telegram_bot_token)
 
     async def _ensure_initialized(self) -> bool:
-        """Ensure bot is initialized."""
-        if self._initialized:
+        """
+        Ensure bot is initialized.
+
+        The API process does this in warmup() at startup; cron scripts
+        without the app lifespan still get the bot on first use.
+        """
+        if self.bot is not None:
             return True
 
-        if not settings.telegram_bot_token:
+        if not self._enabled:
             return False
 
         try:
             from aiogram import Bot
-            self.bot = Bot(token=settings.telegram_bot_token)
-            self._initialized = True
+            from aiogram.client.session.aiohttp import AiohttpSession
+            # One pooled connector for the bot's lifetime, so bursts of
+            # reminders reuse keep-alive connections instead of new
+            # TCP/TLS handshakes
+            session = AiohttpSession(limit=20)
+            self.bot = Bot(token=settings.telegram_bot_token, session=session)
             return True
         except Exception as e:
-            print(f"Failed to initialize Telegram bot: {e}")
+            logger.warning("Failed to initialize Telegram bot: %s", e)
             return False
 
+    async def warmup(self) -> None:
+        """
+        Create the bot at startup and validate the token with one getMe call.
+
+        A rejected token disables notifications for this process instead of
+        failing on every later send; network errors are only reported.
+        """
+        if not await self._ensure_initialized():
+            return
+
+        from aiogram.exceptions import TelegramUnauthorizedError
+        try:
+            await self.bot.get_me(request_timeout=10)
+        except TelegramUnauthorizedError as e:
+            logger.error("Telegram bot token rejected, notifications disabled: %s", e)
+            self._enabled = False
+            await self.close()
+        except Exception as e:
+            logger.warning("Telegram warmup failed: %s", e)
+
     async def notify_admin(self, message: str) -> bool:
         """Send notification to admin."""
         if not await self._ensure_initialized():
@@ -48,7 +110,7 @@ class TelegramNotifier:
             )
             return True
         except Exception as e:
-            print(f"Failed to send admin notification: {e}")
+            logger.warning("Failed to send admin notification: %s", e)
             return False
 
     async def notify_client(self, telegram_id: str, message: str) -> bool:
@@ -67,7 +129,7 @@ class TelegramNotifier:
             )
             return True
         except Exception as e:
-            print(f"Failed to send client notification: {e}")
+            logger.warning("Failed to send client notification: %s", e)
             return False
 
     async def send_payment_reminder(
@@ -77,27 +139,50 @@ class TelegramNotifier:
         days_left: int
     ) -> bool:
         """Send payment reminder to client."""
-        message = f"""
-<b>ProxyGate VPN</b>
-
-{client_name}, ваша подписка истекает через {days_left} дней!
+        if not self._enabled or not telegram_id:
+            return False
 
-Для продления обратитесь к администратору.
-"""
+        message = _PAYMENT_REMINDER_TEMPLATE.format(
+            client_name=client_name,
+            days_left=days_left
+        )
         return await self.notify_client(telegram_id, message)
 
+    async def send_payment_reminders_bulk(
+        self,
+        reminders: List[Tuple[str, str, int]]
+    ) -> List[bool]:
+        """
+        Send many payment reminders concurrently.
+
+        reminders: (telegram_id, client_name, days_left) tuples. At most
+        BULK_SEND_CONCURRENCY are in flight, under Telegram's ~30 msg/s limit.
+        """
+        if not self._enabled:
+            return [False] * len(reminders)
+
+        semaphore = asyncio.Semaphore(self.BULK_SEND_CONCURRENCY)
+
+        async def send_one(telegram_id: str, client_name: str, days_left: int) -> bool:
+            async with semaphore:
+                return await self.send_payment_reminder(telegram_id, client_name, days_left)
+
+        results = await asyncio.gather(
+            *(send_one(*reminder) for reminder in reminders),
+            return_exceptions=True
+        )
+        return [result is True for result in results]
+
     async def send_new_client_notification(
         self,
         client_name: str,
         username: str
     ) -> bool:
         """Notify admin about new client."""
-        message = f"""
-<b>Новый клиент</b>
+        if not self._enabled or not settings.admin_telegram_id:
+            return False
 
-Имя: {client_name}
-Логин: {username}
-"""
+        message = _NEW_CLIENT_TEMPLATE.format(client_name=client_name, username=username)
         return await self.notify_admin(message)
 
     async def send_domain_request_notification(
@@ -107,22 +192,27 @@ class TelegramNotifier:
         reason: Optional[str]
     ) -> bool:
         """Notify admin about domain request."""
-        message = f"""
-<b>Запрос на добавление домена</b>
+        if not self._enabled or not settings.admin_telegram_id:
+            return False
 
-Клиент: {client_name}
-Домен: {domain}
-Причина: {reason or 'Не указана'}
-"""
+        message = _DOMAIN_REQUEST_TEMPLATE.format(
+            client_name=client_name,
+            domain=domain,
+            reason=reason or 'Не указана'
+        )
         return await self.notify_admin(message)
 
     async def send_profile_file(
         self,
         telegram_id: str,
-        file_data: bytes,
+        file_path: Union[str, os.PathLike],
         filename: str
     ) -> bool:
-        """Send profile file to client via Telegram."""
+        """
+        Send profile file to client via Telegram.
+
+        The upload is streamed from disk instead of held in memory.
+        """
         if not await self._ensure_initialized():
             return False
 
@@ -130,23 +220,22 @@ class TelegramNotifier:
             return False
 
         try:
-            from aiogram.types import BufferedInputFile
-            file = BufferedInputFile(file_data, filename=filename)
-
+            from aiogram.types import FSInputFile
             await self.bot.send_document(
                 chat_id=telegram_id,
-                document=file,
+                document=FSInputFile(file_path, filename=filename),
                 caption="Ваш VPN профиль ProxyGate"
             )
             return True
         except Exception as e:
-            print(f"Failed to send profile file: {e}")
+            logger.warning("Failed to send profile file: %s", e)
             return False
 
     async def close(self):
         """Close bot session."""
         if self.bot:
             await self.bot.session.close()
+            self.bot = None
 
 
 # Global instance
@@ -1,8 +1,31 @@
+import base64
+import csv
+import io
 import subprocess
 import os
 import ipaddress
+import shutil
+import time
+import urllib.error
+import urllib.request
 from typing import List, Dict, Optional, Tuple
 from dataclasses import dataclass
+from functools import partial
+
+try:
+    from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+    from cryptography.hazmat.primitives.serialization import (
+        Encoding, NoEncryption, PrivateFormat, PublicFormat
+    )
+except ImportError:  # fall back to the wg binary
+    X25519PrivateKey = None
+
+try:
+    from pyroute2 import WireGuard as NetlinkWireGuard
+except ImportError:  # optional; peer stats fall back to `wg show dump`
+    NetlinkWireGuard = None
+
+from app.utils.helpers import get_external_ip, get_external_ip_async, run_command, which
 
 
 @dataclass
@@ -28,6 +51,82 @@ class WgServerSettings:
     wstunnel_path: str
 
 
+# Config templates (str.format); PresharedKey lines come from _preshared_key_line
+_SERVER_INTERFACE_TEMPLATE = """# ProxyGate WireGuard Server Configuration
+# Auto-generated - DO NOT EDIT MANUALLY
+
+[Interface]
+PrivateKey = {private_key}
+Address = {server_ip}/24
+ListenPort = {listen_port}
+MTU = {mtu}
+
+# Enable IP forwarding and NAT
+PostUp = iptables -A FORWARD -i %i -j ACCEPT; iptables -A FORWARD -o %i -j ACCEPT; iptables -t nat -A POSTROUTING -o $(ip route | grep default | awk '{{print $5}}') -j MASQUERADE
+PostDown = iptables -D FORWARD -i %i -j ACCEPT; iptables -D FORWARD -o %i -j ACCEPT; iptables -t nat -D POSTROUTING -o $(ip route | grep default | awk '{{print $5}}') -j MASQUERADE
+"""
+
+_SERVER_PEER_TEMPLATE = """
+# Client
+[Peer]
+PublicKey = {public_key}
+{preshared_key}AllowedIPs = {assigned_ip}/32
+"""
+
+# Plain `wg` format for `wg syncconf`, which rejects wg-quick keys such as
+# Address, MTU and PostUp
+_SYNC_INTERFACE_TEMPLATE = """[Interface]
+PrivateKey = {private_key}
+ListenPort = {listen_port}
+"""
+
+_CLIENT_CONFIG_TEMPLATE = """[Interface]
+PrivateKey = {private_key}
+Address = {assigned_ip}/32
+DNS = {dns}
+MTU = {mtu}
+
+[Peer]
+PublicKey = {server_public_key}
+{preshared_key}AllowedIPs = 0.0.0.0/0, ::/0
+Endpoint = {endpoint}
+PersistentKeepalive = 25
+"""
+
+
+# Prints "<private> <public>" per line for $1 key pairs
+_GENKEY_LOOP = (
+    'for _ in $(seq "$1"); do '
+    'k=$(wg genkey) && printf "%s %s\\n" "$k" "$(printf "%s" "$k" | wg pubkey)"; '
+    'done'
+)
+
+
+_WG_DUMP = ("wg", "show", "wg0", "dump")
+
+
+def _write_private(path: str, content: str) -> None:
+    """
+    Replace path with content, readable by root only.
+
+    The temp file is created with mode 0600 (never briefly world-readable
+    with the private key in it) and swapped in with os.replace.
+    """
+    tmp_path = f"{path}.tmp"
+    try:
+        os.unlink(tmp_path)
+    except FileNotFoundError:
+        pass
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_CLOEXEC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(content.encode())
+    os.replace(tmp_path, path)
+
+
+def _preshared_key_line(preshared_key: Optional[str]) -> str:
+    return f"PresharedKey = {preshared_key}\n" if preshared_key else ""
+
+
 class WireGuardManager:
     """
     Manages WireGuard VPN server.
@@ -37,7 +136,21 @@ class WireGuardManager:
 
     WG_DIR = "/etc/wireguard"
     WG_CONF = "/etc/wireguard/wg0.conf"
+    WG_SYNC_CONF = "/etc/wireguard/wg0.sync.conf"
     WSTUNNEL_SERVICE = "/etc/systemd/system/wstunnel.service"
+    WSTUNNEL_BIN = "/usr/local/bin/wstunnel"
+    WSTUNNEL_ETAG = "/usr/local/bin/.wstunnel.etag"
+    STATS_TTL_SECONDS = 2.0  # How long a parsed `wg show dump` is reused
+
+    def __init__(self):
+        # (monotonic time, peer stats) from the last read
+        self._stats_cache: Optional[Tuple[float, Dict[str, Dict]]] = None
+        # pyroute2 netlink socket, opened on first use and reused across polls
+        self._netlink = None
+
+    def invalidate_stats(self) -> None:
+        """Drop cached peer stats so the next call re-reads them."""
+        self._stats_cache = None
 
     @staticmethod
     def generate_keypair() -> Tuple[str, str]:
@@ -46,24 +159,20 @@ class WireGuardManager:
 
         Returns: (private_key, public_key)
         """
+        if X25519PrivateKey is not None:
+            # WireGuard keys are base64 of the raw 32-byte X25519 keys
+            private = X25519PrivateKey.generate()
+            private_raw = private.private_bytes(Encoding.Raw, PrivateFormat.Raw, NoEncryption())
+            public_raw = private.public_key().public_bytes(Encoding.Raw, PublicFormat.Raw)
+            return base64.b64encode(private_raw).decode(), base64.b64encode(public_raw).decode()
+
         try:
             # Generate private key
-            private_result = subprocess.run(
-                ["wg", "genkey"],
-                capture_output=True,
-                text=True,
-                check=True
-            )
+            private_result = run_command(("wg", "genkey"), check=True)
             private_key = private_result.stdout.strip()
 
             # Derive public key
-            public_result = subprocess.run(
-                ["wg", "pubkey"],
-                input=private_key,
-                capture_output=True,
-                text=True,
-                check=True
-            )
+            public_result = run_command(("wg", "pubkey"), input=private_key, check=True)
             public_key = public_result.stdout.strip()
 
             return private_key, public_key
@@ -71,106 +180,101 @@ class WireGuardManager:
             return None, None
 
     @staticmethod
-    def generate_preshared_key() -> Optional[str]:
-        """Generate a preshared key for additional security."""
+    def generate_keypairs(count: int) -> List[Tuple[str, str]]:
+        """
+        Generate several key pairs for bulk provisioning.
+
+        Without the cryptography package, all pairs come from a single shell
+        running the wg genkey/pubkey loop rather than two processes per pair.
+        """
+        if X25519PrivateKey is not None or count <= 1:
+            return [WireGuardManager.generate_keypair() for _ in range(count)]
+
         try:
             result = subprocess.run(
-                ["wg", "genpsk"],
+                ["sh", "-c", _GENKEY_LOOP, "sh", str(count)],
                 capture_output=True,
                 text=True,
                 check=True
             )
-            return result.stdout.strip()
         except (subprocess.CalledProcessError, FileNotFoundError):
-            return None
+            return [(None, None)] * count
+        pairs = [tuple(line.split(" ", 1)) for line in result.stdout.splitlines()]
+        return pairs if len(pairs) == count else [(None, None)] * count
+
+    @staticmethod
+    def generate_preshared_key() -> Optional[str]:
+        """Generate a preshared key for additional security."""
+        # Same as `wg genpsk`: 32 random bytes, base64
+        return base64.b64encode(os.urandom(32)).decode()
 
     def is_installed(self) -> bool:
         """Check if WireGuard is installed."""
-        try:
-            result = subprocess.run(
-                ["which", "wg"],
-                capture_output=True,
-                text=True
-            )
-            return result.returncode == 0
-        except FileNotFoundError:
-            return False
+        return which("wg") is not None
 
     def is_running(self) -> bool:
-        """Check if WireGuard interface is up."""
-        try:
-            result = subprocess.run(
-                ["wg", "show", "wg0"],
-                capture_output=True,
-                text=True
-            )
-            return result.returncode == 0
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            return False
+        """Check if WireGuard interface is up (wg-quick creates it, down removes it)."""
+        return os.path.isdir("/sys/class/net/wg0")
 
     def get_server_ip(self) -> Optional[str]:
-        """Get the server's external IP address."""
-        try:
-            import urllib.request
-            with urllib.request.urlopen('https://api.ipify.org', timeout=5) as response:
-                return response.read().decode('utf-8').strip()
-        except Exception:
-            try:
-                with urllib.request.urlopen('https://ifconfig.me', timeout=5) as response:
-                    return response.read().decode('utf-8').strip()
-            except Exception:
-                return None
+        """Get the server's external IP address (cached, see get_external_ip)."""
+        return get_external_ip()
+
+    async def get_server_ip_async(self) -> Optional[str]:
+        """get_server_ip without blocking the event loop on a cache miss."""
+        return await get_external_ip_async()
 
     def get_next_available_ip(self, subnet: str, used_ips: List[str]) -> Optional[str]:
         """
         Get the next available IP in the subnet.
 
-        Skips .0 (network) and .1 (server) addresses.
+        Skips the network address, the server (first host) and broadcast.
         """
         network = ipaddress.ip_network(subnet, strict=False)
-        used_set = set(used_ips)
+        base = int(network.network_address)
+        size = network.num_addresses
+        if size < 4:
+            return None
 
-        for ip in network.hosts():
-            ip_str = str(ip)
-            # Skip .0 and .1 (server uses .1)
-            if ip_str.endswith('.0') or ip_str.endswith('.1'):
+        # One byte per address in the subnet; find() scans for a free one in C
+        taken = bytearray(size)
+        taken[0] = taken[1] = taken[-1] = 1
+        for ip in used_ips:
+            try:
+                offset = int(ipaddress.ip_address(ip)) - base
+            except ValueError:
                 continue
-            if ip_str not in used_set:
-                return ip_str
+            if 0 <= offset < size:
+                taken[offset] = 1
 
-        return None
+        offset = taken.find(0)
+        if offset == -1:
+            return None
+        return str(ipaddress.ip_address(base + offset))
 
     def generate_server_config(self, server_settings: WgServerSettings, clients: List[WgClient]) -> str:
         """
         Generate WireGuard server configuration.
         """
-        config = f"""# ProxyGate WireGuard Server Configuration
-# Auto-generated - DO NOT EDIT MANUALLY
-
-[Interface]
-PrivateKey = {server_settings.private_key}
-Address = {server_settings.server_ip}/24
-ListenPort = {server_settings.listen_port}
-MTU = {server_settings.mtu}
-
-# Enable IP forwarding and NAT
-PostUp = iptables -A FORWARD -i %i -j ACCEPT; iptables -A FORWARD -o %i -j ACCEPT; iptables -t nat -A POSTROUTING -o $(ip route | grep default | awk '{{print $5}}') -j MASQUERADE
-PostDown = iptables -D FORWARD -i %i -j ACCEPT; iptables -D FORWARD -o %i -j ACCEPT; iptables -t nat -D POSTROUTING -o $(ip route | grep default | awk '{{print $5}}') -j MASQUERADE
-"""
+        parts = [_SERVER_INTERFACE_TEMPLATE.format(
+            private_key=server_settings.private_key,
+            server_ip=server_settings.server_ip,
+            listen_port=server_settings.listen_port,
+            mtu=server_settings.mtu,
+        )]
+        append = parts.append
+        render_peer = _SERVER_PEER_TEMPLATE.format
 
         # Add peers (clients)
         for client in clients:
             if client.is_active:
-                config += f"""
-# Client
-[Peer]
-PublicKey = {client.public_key}
-"""
-                if client.preshared_key:
-                    config += f"PresharedKey = {client.preshared_key}\n"
-                config += f"AllowedIPs = {client.assigned_ip}/32\n"
+                append(render_peer(
+                    public_key=client.public_key,
+                    preshared_key=_preshared_key_line(client.preshared_key),
+                    assigned_ip=client.assigned_ip,
+                ))
 
-        return config
+        return "".join(parts)
 
     def generate_client_config(
             self,
@@ -183,6 +287,24 @@ PublicKey = {client.public_key}
         """
         Generate WireGuard client configuration.
         """
+        return self.generate_client_configs(
+            server_public_ip,
+            server_settings,
+            [(client_private_key, client_assigned_ip, client_preshared_key)]
+        )[0]
+
+    def generate_client_configs(
+            self,
+            server_public_ip: str,
+            server_settings: WgServerSettings,
+            clients: List[Tuple[str, str, Optional[str]]]
+    ) -> List[str]:
+        """
+        Generate client configurations for many clients at once.
+
+        clients: (private_key, assigned_ip, preshared_key) per client.
+        The server-side fields are resolved once for the whole batch.
+        """
         # Determine endpoint based on wstunnel
         if server_settings.wstunnel_enabled:
             # wstunnel endpoint - client connects via WebSocket
@@ -190,37 +312,59 @@ PublicKey = {client.public_key}
         else:
             endpoint = f"{server_public_ip}:{server_settings.listen_port}"
 
-        config = f"""[Interface]
-PrivateKey = {client_private_key}
-Address = {client_assigned_ip}/32
-DNS = {server_settings.dns}
-MTU = {server_settings.mtu}
-
-[Peer]
-PublicKey = {server_settings.public_key}
-"""
-
-        if client_preshared_key:
-            config += f"PresharedKey = {client_preshared_key}\n"
-
-        config += f"""AllowedIPs = 0.0.0.0/0, ::/0
-Endpoint = {endpoint}
-PersistentKeepalive = 25
-"""
-
-        return config
+        render = partial(
+            _CLIENT_CONFIG_TEMPLATE.format,
+            dns=server_settings.dns,
+            mtu=server_settings.mtu,
+            server_public_key=server_settings.public_key,
+            endpoint=endpoint,
+        )
+        return [
+            render(
+                private_key=private_key,
+                assigned_ip=assigned_ip,
+                preshared_key=_preshared_key_line(preshared_key),
+            )
+            for private_key, assigned_ip, preshared_key in clients
+        ]
 
     def write_server_config(self, server_settings: WgServerSettings, clients: List[WgClient]) -> None:
         """Write WireGuard server configuration to file."""
         os.makedirs(self.WG_DIR, exist_ok=True)
 
         config = self.generate_server_config(server_settings, clients)
+        _write_private(self.WG_CONF, config)
 
-        with open(self.WG_CONF, 'w') as f:
-            f.write(config)
+    def apply_peer_changes(self, server_settings: WgServerSettings, clients: List[WgClient]) -> bool:
+        """
+        Apply the full peer set to the running interface in one `wg syncconf`.
 
-        # Secure permissions
-        os.chmod(self.WG_CONF, 0o600)
+        Use this instead of add_peer/remove_peer for bulk changes: peers that
+        are unchanged keep their sessions. Returns False if syncconf failed.
+        """
+        self.invalidate_stats()
+        render_peer = _SERVER_PEER_TEMPLATE.format
+        parts = [_SYNC_INTERFACE_TEMPLATE.format(
+            private_key=server_settings.private_key,
+            listen_port=server_settings.listen_port,
+        )]
+        parts.extend(
+            render_peer(
+                public_key=client.public_key,
+                preshared_key=_preshared_key_line(client.preshared_key),
+                assigned_ip=client.assigned_ip,
+            )
+            for client in clients
+            if client.is_active
+        )
+
+        try:
+            os.makedirs(self.WG_DIR, exist_ok=True)
+            _write_private(self.WG_SYNC_CONF, "".join(parts))
+            run_command(("wg", "syncconf", "wg0", self.WG_SYNC_CONF), check=True)
+            return True
+        except (subprocess.CalledProcessError, FileNotFoundError, OSError):
+            return False
 
     def setup_wstunnel(self, port: int, wg_port: int, path: str) -> bool:
         """
@@ -245,12 +389,24 @@ WantedBy=multi-user.target
 """
 
         try:
-            with open(self.WSTUNNEL_SERVICE, 'w') as f:
-                f.write(service)
-
-            subprocess.run(["systemctl", "daemon-reload"], check=True)
-            subprocess.run(["systemctl", "enable", "wstunnel"], check=True)
-            subprocess.run(["systemctl", "restart", "wstunnel"], check=True)
+            try:
+                with open(self.WSTUNNEL_SERVICE) as f:
+                    changed = f.read() != service
+            except FileNotFoundError:
+                changed = True
+
+            if changed:
+                tmp_path = f"{self.WSTUNNEL_SERVICE}.tmp"
+                with open(tmp_path, 'w') as f:
+                    f.write(service)
+                os.replace(tmp_path, self.WSTUNNEL_SERVICE)
+
+                subprocess.run(["systemctl", "daemon-reload"], check=True)
+                subprocess.run(["systemctl", "enable", "wstunnel"], check=True)
+                subprocess.run(["systemctl", "restart", "--no-block", "wstunnel"], check=True)
+            else:
+                # Same unit: just make sure it is enabled and running
+                subprocess.run(["systemctl", "enable", "--now", "--no-block", "wstunnel"], check=True)
             return True
         except (subprocess.CalledProcessError, FileNotFoundError, IOError):
             return False
@@ -275,17 +431,31 @@ WantedBy=multi-user.target
             # Download from GitHub releases
             url = f"https://github.com/erebe/wstunnel/releases/latest/download/wstunnel_{arch_suffix}"
 
-            subprocess.run(
-                ["curl", "-L", "-o", "/usr/local/bin/wstunnel", url],
-                check=True,
-                timeout=120
-            )
-            subprocess.run(
-                ["chmod", "+x", "/usr/local/bin/wstunnel"],
-                check=True
-            )
+            # Conditional GET: an unchanged release answers 304 with no body
+            headers = {}
+            if os.path.exists(self.WSTUNNEL_BIN):
+                try:
+                    with open(self.WSTUNNEL_ETAG) as f:
+                        headers["If-None-Match"] = f.read().strip()
+                except FileNotFoundError:
+                    pass
+
+            tmp_path = f"{self.WSTUNNEL_BIN}.new"
+            try:
+                with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=120) as response:
+                    etag = response.headers.get("ETag")
+                    with open(tmp_path, 'wb') as f:
+                        shutil.copyfileobj(response, f, 1 << 20)
+            except urllib.error.HTTPError as e:
+                return e.code == 304
+
+            os.chmod(tmp_path, 0o755)
+            os.replace(tmp_path, self.WSTUNNEL_BIN)
+            if etag:
+                with open(self.WSTUNNEL_ETAG, 'w') as f:
+                    f.write(etag)
             return True
-        except (subprocess.CalledProcessError, subprocess.TimeoutExpired, FileNotFoundError):
+        except (subprocess.CalledProcessError, urllib.error.URLError, OSError):
             return False
 
     def start(self) -> bool:
@@ -328,14 +498,10 @@ WantedBy=multi-user.target
 
         Uses wg syncconf for minimal disruption.
         """
+        self.invalidate_stats()
         try:
             # First try to sync config without restarting
-            subprocess.run(
-                ["wg", "syncconf", "wg0", self.WG_CONF],
-                check=True,
-                capture_output=True,
-                text=True
-            )
+            run_command(("wg", "syncconf", "wg0", self.WG_CONF), check=True)
             return True
         except subprocess.CalledProcessError:
             # If syncconf fails, restart the interface
@@ -358,63 +524,106 @@ WantedBy=multi-user.target
             return False
 
     def install(self) -> bool:
-        """Install WireGuard."""
-        try:
-            # Try apt (Debian/Ubuntu)
-            result = subprocess.run(
-                ["apt", "install", "-y", "wireguard", "wireguard-tools"],
-                capture_output=True,
-                text=True
-            )
-            if result.returncode == 0:
-                return True
+        """Install WireGuard (no-op if wg is already present)."""
+        if self.is_installed():
+            return True
 
-            # Try yum (CentOS/RHEL)
-            result = subprocess.run(
-                ["yum", "install", "-y", "wireguard-tools"],
-                capture_output=True,
-                text=True
-            )
-            return result.returncode == 0
+        # Use whichever package manager this system has
+        if shutil.which("apt-get"):
+            # Debian/Ubuntu
+            cmd = ["apt-get", "install", "-y", "-q", "wireguard", "wireguard-tools"]
+        elif shutil.which("dnf"):
+            cmd = ["dnf", "install", "-y", "-q", "wireguard-tools"]
+        elif shutil.which("yum"):
+            # CentOS/RHEL
+            cmd = ["yum", "install", "-y", "-q", "wireguard-tools"]
+        else:
+            return False
 
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True)
+            return result.returncode == 0
         except FileNotFoundError:
             return False
+        finally:
+            which.cache_clear()
 
     def get_peer_stats(self) -> Dict[str, Dict]:
         """
         Get statistics for all peers.
 
         Returns: {public_key: {"rx": bytes, "tx": bytes, "last_handshake": timestamp}}
+
+        Read over netlink when pyroute2 is installed, otherwise parsed from
+        `wg show wg0 dump`. The result is cached for STATS_TTL_SECONDS.
         """
+        cached = self._stats_cache
+        if cached is not None and time.monotonic() - cached[0] < self.STATS_TTL_SECONDS:
+            return cached[1]
+
+        stats = self._read_peer_stats_netlink()
+        if stats is None:
+            stats = self._read_peer_stats_dump()
+            if stats is None:
+                return {}
+
+        self._stats_cache = (time.monotonic(), stats)
+        return stats
+
+    def _read_peer_stats_netlink(self) -> Optional[Dict[str, Dict]]:
+        """Peer stats from the kernel over netlink; None if unavailable."""
+        if NetlinkWireGuard is None:
+            return None
         try:
-            result = subprocess.run(
-                ["wg", "show", "wg0", "dump"],
-                capture_output=True,
-                text=True,
-                check=True
-            )
+            if self._netlink is None:
+                self._netlink = NetlinkWireGuard()
+            messages = self._netlink.info("wg0")
+        except Exception:
+            self._netlink = None
+            return None
 
-            stats = {}
-            lines = result.stdout.strip().split('\n')
-
-            # Skip first line (interface info)
-            for line in lines[1:]:
-                parts = line.split('\t')
-                if len(parts) >= 6:
-                    public_key = parts[0]
-                    last_handshake = int(parts[4]) if parts[4] != '0' else None
-                    rx_bytes = int(parts[5])
-                    tx_bytes = int(parts[6]) if len(parts) > 6 else 0
-
-                    stats[public_key] = {
-                        "rx": rx_bytes,
-                        "tx": tx_bytes,
-                        "last_handshake": last_handshake
-                    }
-
-            return stats
+        stats = {}
+        for message in messages:
+            for peer in message.get_attr("WGDEVICE_A_PEERS") or ():
+                public_key = peer.get_attr("WGPEER_A_PUBLIC_KEY")
+                if isinstance(public_key, bytes):
+                    public_key = (
+                        base64.b64encode(public_key) if len(public_key) == 32 else public_key
+                    ).decode()
+                handshake = peer.get_attr("WGPEER_A_LAST_HANDSHAKE_TIME")
+                if isinstance(handshake, dict):
+                    handshake = handshake.get("tv_sec")
+                stats[public_key] = {
+                    "rx": peer.get_attr("WGPEER_A_RX_BYTES") or 0,
+                    "tx": peer.get_attr("WGPEER_A_TX_BYTES") or 0,
+                    "last_handshake": handshake or None
+                }
+        return stats
+
+    def _read_peer_stats_dump(self) -> Optional[Dict[str, Dict]]:
+        """Peer stats parsed from `wg show wg0 dump`; None if wg failed."""
+        try:
+            result = run_command(_WG_DUMP, check=True)
         except (subprocess.CalledProcessError, FileNotFoundError):
-            return {}
+            return None
+
+        stats = {}
+        to_int = int
+        rows = csv.reader(io.StringIO(result.stdout), delimiter='\t', quoting=csv.QUOTE_NONE)
+
+        # Skip first line (interface info); peer lines are
+        # key, psk, endpoint, allowed-ips, handshake, rx, tx, keepalive
+        next(rows, None)
+        for parts in rows:
+            if len(parts) >= 6:
+                handshake = parts[4]
+                stats[parts[0]] = {
+                    "rx": to_int(parts[5]),
+                    "tx": to_int(parts[6]) if len(parts) > 6 else 0,
+                    "last_handshake": to_int(handshake) if handshake != '0' else None
+                }
+
+        return stats
 
     def add_peer(
             self,
@@ -423,26 +632,23 @@ WantedBy=multi-user.target
             preshared_key: Optional[str] = None
     ) -> bool:
         """Add a peer dynamically without restarting."""
+        self.invalidate_stats()
         try:
             cmd = ["wg", "set", "wg0", "peer", public_key, "allowed-ips", f"{assigned_ip}/32"]
             if preshared_key:
                 cmd.extend(["preshared-key", "/dev/stdin"])
-                subprocess.run(cmd, input=preshared_key, capture_output=True, text=True, check=True)
+                run_command(cmd, input=preshared_key, check=True)
             else:
-                subprocess.run(cmd, capture_output=True, text=True, check=True)
+                run_command(cmd, check=True)
             return True
         except (subprocess.CalledProcessError, FileNotFoundError):
             return False
 
     def remove_peer(self, public_key: str) -> bool:
         """Remove a peer dynamically."""
+        self.invalidate_stats()
         try:
-            subprocess.run(
-                ["wg", "set", "wg0", "peer", public_key, "remove"],
-                capture_output=True,
-                text=True,
-                check=True
-            )
+            run_command(("wg", "set", "wg0", "peer", public_key, "remove"), check=True)
             return True
         except (subprocess.CalledProcessError, FileNotFoundError):
             return False
@@ -452,12 +658,18 @@ WantedBy=multi-user.target
             server_settings: WgServerSettings,
             client_private_key: str,
             client_assigned_ip: str,
-            client_preshared_key: Optional[str] = None
+            client_preshared_key: Optional[str] = None,
+            *,
+            server_ip: Optional[str] = None
     ) -> Dict:
         """
         Get all connection information for a client.
+
+        Pass server_ip when the caller already has it (e.g. once per export)
+        to skip the external IP lookup.
         """
-        server_ip = self.get_server_ip()
+        if server_ip is None:
+            server_ip = self.get_server_ip()
 
         config = self.generate_client_config(
             server_ip,
@@ -1,19 +1,44 @@
+import base64
+import hashlib
 import subprocess
-import json
 import uuid
 import os
-from typing import List, Dict, Optional
+import shutil
+import time
+import urllib.error
+import urllib.request
+from typing import List, Dict, Optional, Tuple
 from dataclasses import dataclass
+from contextlib import contextmanager
+from functools import lru_cache, wraps
+from urllib.parse import quote, urlencode
 
+import orjson
 
-@dataclass
+try:
+    from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+    from cryptography.hazmat.primitives.serialization import (
+        Encoding, NoEncryption, PrivateFormat, PublicFormat
+    )
+except ImportError:  # fall back to the xray binary
+    X25519PrivateKey = None
+
+try:
+    import dbus
+except ImportError:  # optional; service control falls back to systemctl
+    dbus = None
+
+from app.utils.helpers import get_external_ip, get_external_ip_async, run_command
+
+
+@dataclass(frozen=True, slots=True)
 class XrayClient:
     uuid: str
     short_id: Optional[str]
     is_active: bool
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class XrayServerSettings:
     port: int
     private_key: str
@@ -24,6 +49,65 @@ class XrayServerSettings:
     server_name: str
 
 
+STATUS_TTL_SECONDS = 2.0
+
+# systemd Manager D-Bus calls equivalent to `systemctl <action> xray`
+_XRAY_UNIT = "xray.service"
+_SYSTEMD_ACTIONS = {
+    "start": lambda manager: manager.StartUnit(_XRAY_UNIT, "replace"),
+    "stop": lambda manager: manager.StopUnit(_XRAY_UNIT, "replace"),
+    "restart": lambda manager: manager.RestartUnit(_XRAY_UNIT, "replace"),
+    # systemctl enable also reloads the daemon
+    "enable": lambda manager: (
+        manager.EnableUnitFiles([_XRAY_UNIT], False, True), manager.Reload()
+    ),
+}
+
+
+def _ttl_cache(ttl: float):
+    """Memoize a function by its arguments for ttl seconds; adds cache_clear()"""
+    def decorator(func):
+        cache = {}
+
+        @wraps(func)
+        def wrapper(*args):
+            now = time.monotonic()
+            hit = cache.get(args)
+            if hit is not None and hit[1] > now:
+                return hit[0]
+            value = func(*args)
+            cache[args] = (value, now + ttl)
+            return value
+
+        wrapper.cache_clear = cache.clear
+        return wrapper
+    return decorator
+
+
+@_ttl_cache(STATUS_TTL_SECONDS)
+def _xray_installed() -> bool:
+    """Whether the xray binary exists (cached briefly, cleared by XRayManager.install())"""
+    return os.path.exists("/usr/local/bin/xray")
+
+
+@lru_cache(maxsize=256)
+def _vless_url_suffix(domain: str, port: int, ws_path: str, name: str) -> str:
+    """Everything after the UUID in a VLESS+WS+TLS URL; shared by all clients of a domain"""
+    query = urlencode(
+        {
+            "encryption": "none",
+            "security": "tls",
+            "sni": domain,
+            "type": "ws",
+            "host": domain,
+            "path": ws_path,
+        },
+        safe="/",
+        quote_via=quote,
+    )
+    return f"@{domain}:{port}?{query}#{quote(name)}"
+
+
 class XRayManager:
     """
     Manages XRay VLESS + WebSocket server (behind Cloudflare CDN).
@@ -37,6 +121,75 @@ class XRayManager:
     CLIENT_CONFIG_DIR = "/root/xray-client"
     WS_PATH = "/ray"
     WS_LOCAL_PORT = 10443
+    SERVICE_CGROUP_PROCS = "/sys/fs/cgroup/system.slice/xray.service/cgroup.procs"
+    INSTALL_SCRIPT_URL = "https://github.com/XTLS/Xray-install/raw/main/install-release.sh"
+    INSTALL_SCRIPT = "/var/cache/proxygate/xray-install-release.sh"
+
+    def __init__(self):
+        # systemd Manager proxy on the system bus, opened on first use
+        self._systemd = None
+        # ((server settings, active client UUIDs), serialized config) of the last write
+        self._config_payload: Optional[Tuple[tuple, bytes]] = None
+        # (sha256, mtime_ns, size) of the config file as we last wrote or verified it
+        self._last_written: Optional[Tuple[bytes, int, int]] = None
+        # Inside batch(): config changes are written but the restart is deferred
+        self._batch_depth = 0
+        self._batch_dirty = False
+
+    @contextmanager
+    def batch(self):
+        """
+        Group add_client/remove_client calls into one restart at the end.
+
+        Every restart drops all live connections, so bulk changes should
+        restart once rather than once per client.
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0 and self._batch_dirty:
+                self._batch_dirty = False
+                self.reload()
+
+    def _apply_config(self, server_settings: XrayServerSettings, clients: List[XrayClient]) -> bool:
+        """Write the config and restart if it changed (deferred inside batch())."""
+        if not self.write_config(server_settings, clients):
+            return True
+        if self._batch_depth:
+            self._batch_dirty = True
+            return True
+        return self.reload()
+
+    def _systemctl(self, action: str) -> None:
+        """
+        Run a systemctl action on the xray unit.
+
+        Goes over D-Bus (one connection for the manager's lifetime) when
+        dbus-python is installed, otherwise forks systemctl. Raises
+        CalledProcessError / FileNotFoundError like subprocess.run. Over
+        D-Bus the call returns once the job is queued, as with --no-block.
+        """
+        if dbus is not None:
+            try:
+                if self._systemd is None:
+                    self._systemd = dbus.Interface(
+                        dbus.SystemBus().get_object("org.freedesktop.systemd1", "/org/freedesktop/systemd1"),
+                        "org.freedesktop.systemd1.Manager"
+                    )
+                _SYSTEMD_ACTIONS[action](self._systemd)
+                return
+            except dbus.DBusException as e:
+                self._systemd = None
+                raise subprocess.CalledProcessError(1, ["systemctl", action, "xray"], stderr=str(e))
+
+        subprocess.run(
+            ["systemctl", action, "xray"],
+            check=True,
+            capture_output=True,
+            text=True
+        )
 
     @staticmethod
     def generate_uuid() -> str:
@@ -55,17 +208,21 @@ class XRayManager:
 
         Returns: (private_key, public_key)
         """
-        try:
-            result = subprocess.run(
-                ["/usr/local/bin/xray", "x25519"],
-                capture_output=True,
-                text=True,
-                check=True
+        if X25519PrivateKey is not None:
+            # Same encoding as `xray x25519`: unpadded URL-safe base64 of the raw keys
+            private = X25519PrivateKey.generate()
+            private_raw = private.private_bytes(Encoding.Raw, PrivateFormat.Raw, NoEncryption())
+            public_raw = private.public_key().public_bytes(Encoding.Raw, PublicFormat.Raw)
+            return (
+                base64.urlsafe_b64encode(private_raw).rstrip(b"=").decode(),
+                base64.urlsafe_b64encode(public_raw).rstrip(b"=").decode(),
             )
-            lines = result.stdout.strip().split('\n')
+
+        try:
+            result = run_command(["/usr/local/bin/xray", "x25519"], check=True)
             private_key = None
             public_key = None
-            for line in lines:
+            for line in result.stdout.splitlines():
                 key, _, value = line.partition(":")
                 key = key.strip().lower()
                 value = value.strip()
@@ -75,37 +232,40 @@ class XRayManager:
                     public_key = value
             return private_key, public_key
         except (subprocess.CalledProcessError, FileNotFoundError):
-            # Fallback: generate using openssl (less secure but works)
             return None, None
 
     def is_installed(self) -> bool:
         """Check if XRay is installed."""
-        return os.path.exists("/usr/local/bin/xray")
+        return _xray_installed()
 
+    @_ttl_cache(STATUS_TTL_SECONDS)
     def is_running(self) -> bool:
-        """Check if XRay service is running."""
+        """Check if XRay service is running (cached briefly, cleared on start/stop)."""
+        # With the unified cgroup hierarchy systemd keeps one cgroup per unit
+        # and removes it once the unit stops: a non-empty cgroup.procs means
+        # the service has live processes, without forking systemctl
+        if os.path.exists("/sys/fs/cgroup/cgroup.controllers"):
+            try:
+                with open(self.SERVICE_CGROUP_PROCS) as f:
+                    return bool(f.read().strip())
+            except FileNotFoundError:
+                return False
+            except OSError:
+                pass
+
         try:
-            result = subprocess.run(
-                ["systemctl", "is-active", "xray"],
-                capture_output=True,
-                text=True
-            )
+            result = run_command(("systemctl", "is-active", "xray"))
             return result.stdout.strip() == "active"
         except (subprocess.CalledProcessError, FileNotFoundError):
             return False
 
     def get_server_ip(self) -> Optional[str]:
-        """Get the server's external IP address."""
-        try:
-            import urllib.request
-            with urllib.request.urlopen('https://api.ipify.org', timeout=5) as response:
-                return response.read().decode('utf-8').strip()
-        except Exception:
-            try:
-                with urllib.request.urlopen('https://ifconfig.me', timeout=5) as response:
-                    return response.read().decode('utf-8').strip()
-            except Exception:
-                return None
+        """Get the server's external IP address (cached, see get_external_ip)."""
+        return get_external_ip()
+
+    async def get_server_ip_async(self) -> Optional[str]:
+        """get_server_ip without blocking the event loop on a cache miss."""
+        return await get_external_ip_async()
 
     def generate_config(self, server_settings: XrayServerSettings, clients: List[XrayClient]) -> dict:
         """
@@ -113,10 +273,11 @@ class XRayManager:
 
         XRay listens locally, nginx handles TLS termination.
         """
-        client_list = []
-        for client in clients:
-            if client.is_active:
-                client_list.append({"id": client.uuid})
+        # One entry per active UUID, in client order (dict keys: linear dedupe)
+        client_list = [
+            {"id": client_uuid}
+            for client_uuid in dict.fromkeys(c.uuid for c in clients if c.is_active)
+        ]
 
         config = {
             "log": {
@@ -256,27 +417,50 @@ class XRayManager:
 
         Traffic: client → Cloudflare CDN (TLS) → nginx (TLS) → XRay (WS)
         """
-        from urllib.parse import quote
-        url = (
-            f"vless://{client_uuid}@{domain}:{server_settings.port}"
-            f"?encryption=none"
-            f"&security=tls"
-            f"&sni={domain}"
-            f"&type=ws"
-            f"&host={domain}"
-            f"&path={quote(self.WS_PATH)}"
-            f"#{name}"
-        )
-        return url
+        return f"vless://{client_uuid}{_vless_url_suffix(domain, server_settings.port, self.WS_PATH, name)}"
 
-    def write_config(self, server_settings: XrayServerSettings, clients: List[XrayClient]) -> None:
-        """Write XRay configuration to file."""
+    def write_config(self, server_settings: XrayServerSettings, clients: List[XrayClient]) -> bool:
+        """
+        Write XRay configuration to file.
+
+        Returns False if the file already has this exact config, so callers
+        can skip the reload (a restart drops every connection). The new file
+        is swapped in with os.replace so xray never reads a partial config.
+        """
         os.makedirs(self.XRAY_DIR, exist_ok=True)
 
-        config = self.generate_config(server_settings, clients)
+        # Reuse the last serialized config if the inputs are the same
+        key = (server_settings, tuple(c.uuid for c in clients if c.is_active))
+        if self._config_payload is not None and self._config_payload[0] == key:
+            payload = self._config_payload[1]
+        else:
+            config = self.generate_config(server_settings, clients)
+            payload = orjson.dumps(config, option=orjson.OPT_INDENT_2)
+            self._config_payload = (key, payload)
 
-        with open(self.CONFIG_FILE, 'w') as f:
-            json.dump(config, f, indent=2)
+        digest = hashlib.sha256(payload).digest()
+        try:
+            st = os.stat(self.CONFIG_FILE)
+        except FileNotFoundError:
+            st = None
+        if st is not None:
+            # Our own last write, untouched since: no need to read it back
+            if self._last_written == (digest, st.st_mtime_ns, st.st_size):
+                return False
+            with open(self.CONFIG_FILE, 'rb') as f:
+                if f.read() == payload:
+                    self._last_written = (digest, st.st_mtime_ns, st.st_size)
+                    return False
+
+        # 0644: the xray service runs as nobody and must be able to read it
+        tmp_path = f"{self.CONFIG_FILE}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC, 0o644)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+        st = os.stat(tmp_path)
+        os.replace(tmp_path, self.CONFIG_FILE)
+        self._last_written = (digest, st.st_mtime_ns, st.st_size)
+        return True
 
     def reload(self) -> bool:
         """
@@ -284,13 +468,9 @@ class XRayManager:
 
         XRay supports hot reload via SIGUSR1 or systemctl restart.
         """
+        self.is_running.cache_clear()
         try:
-            subprocess.run(
-                ["systemctl", "restart", "xray"],
-                check=True,
-                capture_output=True,
-                text=True
-            )
+            self._systemctl("restart")
             return True
         except subprocess.CalledProcessError as e:
             print(f"Failed to restart XRay: {e.stderr}")
@@ -301,43 +481,55 @@ class XRayManager:
 
     def start(self) -> bool:
         """Start XRay service."""
+        self.is_running.cache_clear()
         try:
-            subprocess.run(
-                ["systemctl", "start", "xray"],
-                check=True,
-                capture_output=True,
-                text=True
-            )
+            self._systemctl("start")
             return True
         except (subprocess.CalledProcessError, FileNotFoundError):
             return False
 
     def stop(self) -> bool:
         """Stop XRay service."""
+        self.is_running.cache_clear()
         try:
-            subprocess.run(
-                ["systemctl", "stop", "xray"],
-                check=True,
-                capture_output=True,
-                text=True
-            )
+            self._systemctl("stop")
             return True
         except (subprocess.CalledProcessError, FileNotFoundError):
             return False
 
     def enable(self) -> bool:
         """Enable XRay service to start on boot."""
+        self.is_running.cache_clear()
         try:
-            subprocess.run(
-                ["systemctl", "enable", "xray"],
-                check=True,
-                capture_output=True,
-                text=True
-            )
+            self._systemctl("enable")
             return True
         except (subprocess.CalledProcessError, FileNotFoundError):
             return False
 
+    def _download_install_script(self) -> bool:
+        """
+        Fetch the install script into INSTALL_SCRIPT.
+
+        A retry after a failed install reuses the script downloaded less than
+        an hour ago; if GitHub is unreachable any cached copy is used.
+        """
+        try:
+            if time.time() - os.path.getmtime(self.INSTALL_SCRIPT) < 3600:
+                return True
+        except OSError:
+            pass
+
+        tmp_path = f"{self.INSTALL_SCRIPT}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.INSTALL_SCRIPT), exist_ok=True)
+            with urllib.request.urlopen(self.INSTALL_SCRIPT_URL, timeout=60) as response:
+                with open(tmp_path, 'wb') as f:
+                    shutil.copyfileobj(response, f)
+            os.replace(tmp_path, self.INSTALL_SCRIPT)
+            return True
+        except (urllib.error.URLError, OSError):
+            return os.path.exists(self.INSTALL_SCRIPT)
+
     def install(self) -> bool:
         """
         Install XRay using the official install script.
@@ -345,16 +537,17 @@ class XRayManager:
         This downloads and installs XRay from GitHub.
         """
         try:
-            # Download and run the install script
-            result = subprocess.run(
-                ["bash", "-c", 'bash -c "$(curl -L https://github.com/XTLS/Xray-install/raw/main/install-release.sh)" @ install'],
-                capture_output=True,
-                text=True,
+            if not self._download_install_script():
+                return False
+            result = run_command(
+                ["bash", self.INSTALL_SCRIPT, "install"],
                 timeout=300  # 5 minutes timeout
             )
             return result.returncode == 0
         except (subprocess.CalledProcessError, subprocess.TimeoutExpired, FileNotFoundError):
             return False
+        finally:
+            _xray_installed.cache_clear()
 
     def get_traffic_stats(self) -> Dict[str, Dict[str, int]]:
         """
@@ -368,14 +561,12 @@ class XRayManager:
         return {}
 
     def add_client(self, client: XrayClient, server_settings: XrayServerSettings, all_clients: List[XrayClient]) -> bool:
-        """Add a new client and reload config."""
-        self.write_config(server_settings, all_clients)
-        return self.reload()
+        """Add a new client and reload config if it changed."""
+        return self._apply_config(server_settings, all_clients)
 
     def remove_client(self, client_uuid: str, server_settings: XrayServerSettings, all_clients: List[XrayClient]) -> bool:
-        """Remove a client and reload config."""
-        self.write_config(server_settings, all_clients)
-        return self.reload()
+        """Remove a client and reload config if it changed."""
+        return self._apply_config(server_settings, all_clients)
 
     def get_connection_info(
             self,
@@ -1,10 +1,18 @@
-from typing import Optional, Set
+from typing import Optional, Sequence, Set, Tuple
 from datetime import date, datetime
+from functools import lru_cache
+import os
 import re
+import shutil
+import subprocess
+import time
+import urllib.request
 
+import httpx
 
-# Russian to Latin transliteration map
-TRANSLIT_MAP = {
+
+# Russian to Latin transliteration, as a str.translate table
+_TRANSLIT_TABLE = str.maketrans({
     'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'yo',
     'ж': 'zh', 'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm',
     'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
@@ -15,18 +23,13 @@ TRANSLIT_MAP = {
     'Н': 'N', 'О': 'O', 'П': 'P', 'Р': 'R', 'С': 'S', 'Т': 'T', 'У': 'U',
     'Ф': 'F', 'Х': 'Kh', 'Ц': 'Ts', 'Ч': 'Ch', 'Ш': 'Sh', 'Щ': 'Shch',
     'Ъ': '', 'Ы': 'Y', 'Ь': '', 'Э': 'E', 'Ю': 'Yu', 'Я': 'Ya'
-}
+})
+_NON_ALNUM_RE = re.compile(r'[^a-zA-Z0-9]+')
 
 
 def transliterate(text: str) -> str:
     """Transliterate Russian text to Latin."""
-    result = []
-    for char in text:
-        if char in TRANSLIT_MAP:
-            result.append(TRANSLIT_MAP[char])
-        else:
-            result.append(char)
-    return ''.join(result)
+    return text.translate(_TRANSLIT_TABLE)
 
 
 def generate_username(client_id: int, name: str = "", existing_usernames: Optional[Set[str]] = None) -> str:
@@ -47,7 +50,7 @@ def generate_username(client_id: int, name: str = "", existing_usernames: Option
         # Transliterate Russian
         base = transliterate(name.strip())
         # Keep only alphanumeric chars, convert to lowercase
-        base = re.sub(r'[^a-zA-Z0-9]', '', base).lower()
+        base = _NON_ALNUM_RE.sub('', base).lower()
 
         # If we got a valid base name
         if base and len(base) >= 2:
@@ -55,11 +58,17 @@ def generate_username(client_id: int, name: str = "", existing_usernames: Option
             if base not in existing_usernames:
                 return base
 
-            # Add numbers until unique
-            for i in range(1, 1000):
-                candidate = f"{base}{i}"
-                if candidate not in existing_usernames:
-                    return candidate
+            # Add a number past the highest one already taken
+            prefix_len = len(base)
+            max_suffix = max(
+                (
+                    int(u[prefix_len:])
+                    for u in existing_usernames
+                    if u.startswith(base) and u[prefix_len:].isdigit()
+                ),
+                default=0
+            )
+            return f"{base}{max_suffix + 1}"
 
     # Fallback to client_XXX format
     return f"client_{client_id:03d}"
@@ -90,17 +99,112 @@ def format_date_range(valid_from: date, valid_until: date) -> str:
     return f"{valid_from.strftime('%d.%m')} - {valid_until.strftime('%d.%m.%Y')}"
 
 
+# Optional protocol and www. prefix, then the host up to the first slash
+_DOMAIN_RE = re.compile(r'(?:https?://)?(?:www\.)?([^/]*)', re.IGNORECASE)
+
+
 def normalize_domain(domain: str) -> str:
     """Normalize domain name (lowercase, strip whitespace)."""
-    domain = domain.lower().strip()
-    # Remove protocol if present
-    if domain.startswith("http://"):
-        domain = domain[7:]
-    elif domain.startswith("https://"):
-        domain = domain[8:]
-    # Remove path
-    domain = domain.split("/")[0]
-    # Remove www. prefix
-    if domain.startswith("www."):
-        domain = domain[4:]
-    return domain
+    return _DOMAIN_RE.match(domain.strip()).group(1).lower()
+
+
+EXTERNAL_IP_TTL_SECONDS = 3600
+# Shared by the API and the cron scripts, and kept across restarts
+EXTERNAL_IP_CACHE_FILE = "/var/cache/proxygate/external_ip"
+_EXTERNAL_IP_SERVICES = ("https://api.ipify.org", "https://ifconfig.me")
+_external_ip: Optional[Tuple[float, str]] = None
+
+
+def _read_cached_external_ip() -> Optional[Tuple[float, str]]:
+    """(wall-clock time it was written, ip) from the cache file, if any"""
+    try:
+        with open(EXTERNAL_IP_CACHE_FILE) as f:
+            ip = f.read().strip()
+        return (os.path.getmtime(EXTERNAL_IP_CACHE_FILE), ip) if ip else None
+    except OSError:
+        return None
+
+
+def _write_cached_external_ip(ip: str) -> None:
+    try:
+        os.makedirs(os.path.dirname(EXTERNAL_IP_CACHE_FILE), exist_ok=True)
+        tmp_path = f"{EXTERNAL_IP_CACHE_FILE}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(ip)
+        os.replace(tmp_path, EXTERNAL_IP_CACHE_FILE)
+    except OSError:
+        pass
+
+
+def get_external_ip() -> Optional[str]:
+    """
+    Server's public IP as seen by an external echo service.
+
+    A successful lookup is reused for EXTERNAL_IP_TTL_SECONDS, in memory and
+    through EXTERNAL_IP_CACHE_FILE; failures are not cached.
+    """
+    global _external_ip
+    now = time.time()
+    cached = _external_ip or _read_cached_external_ip()
+    if cached is not None and now - cached[0] < EXTERNAL_IP_TTL_SECONDS:
+        _external_ip = cached
+        return cached[1]
+
+    for url in _EXTERNAL_IP_SERVICES:
+        try:
+            with urllib.request.urlopen(url, timeout=5) as response:
+                ip = response.read().decode('utf-8').strip()
+        except Exception:
+            continue
+        if ip:
+            _external_ip = (now, ip)
+            _write_cached_external_ip(ip)
+            return ip
+    return None
+
+
+async def get_external_ip_async() -> Optional[str]:
+    """get_external_ip for request handlers: the lookup doesn't block the event loop."""
+    global _external_ip
+    now = time.time()
+    cached = _external_ip or _read_cached_external_ip()
+    if cached is not None and now - cached[0] < EXTERNAL_IP_TTL_SECONDS:
+        _external_ip = cached
+        return cached[1]
+
+    timeout = httpx.Timeout(5.0, connect=2.0)
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        for url in _EXTERNAL_IP_SERVICES:
+            try:
+                response = await client.get(url)
+                response.raise_for_status()
+            except httpx.HTTPError:
+                continue
+            ip = response.text.strip()
+            if ip:
+                _external_ip = (now, ip)
+                _write_cached_external_ip(ip)
+                return ip
+    return None
+
+
+@lru_cache(maxsize=32)
+def which(name: str) -> Optional[str]:
+    """Cached shutil.which; call which.cache_clear() after installing binaries"""
+    return shutil.which(name)
+
+
+def run_command(cmd: Sequence[str], **kwargs) -> subprocess.CompletedProcess:
+    """
+    subprocess.run with captured text output, started via posix_spawn.
+
+    CPython only uses posix_spawn for an absolute executable and
+    close_fds=False; the latter is safe since Python creates fds
+    non-inheritable. Raises FileNotFoundError if the binary is missing.
+    """
+    path = which(cmd[0])
+    if path is None:
+        raise FileNotFoundError(cmd[0])
+    return subprocess.run(
+        (path, *cmd[1:]), capture_output=True, text=True, close_fds=False, **kwargs
+    )
@@ -1,16 +1,36 @@
 from datetime import datetime, timedelta, timezone
-from typing import Optional, Literal
+from functools import lru_cache
+from typing import Dict, Optional, Literal, Tuple
+import base64
+import hashlib
+import hmac
+import os
 import secrets
 import string
+import struct
+import time
+import unicodedata
 
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+from passlib.hash import argon2
 import pyotp
 
 from app.config import settings
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# New hashes use argon2 when argon2-cffi is installed (a verify takes a
+# fraction of bcrypt's ~250ms at these parameters); bcrypt hashes keep working.
+if argon2.has_backend():
+    pwd_context = CryptContext(
+        schemes=["argon2", "bcrypt"],
+        deprecated="auto",
+        argon2__time_cost=2,
+        argon2__memory_cost=65536,
+        argon2__parallelism=2,
+    )
+else:
+    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -23,10 +43,20 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+_PASSWORD_ALPHABET = string.ascii_letters + string.digits
+# Largest multiple of the alphabet size that fits in a byte; bytes at or
+# above it are rejected so every character stays equally likely
+_PASSWORD_BYTE_LIMIT = 256 - 256 % len(_PASSWORD_ALPHABET)
+
+
 def generate_password(length: int = 16) -> str:
     """Generate a random password."""
-    alphabet = string.ascii_letters + string.digits
-    return ''.join(secrets.choice(alphabet) for _ in range(length))
+    chars = []
+    while len(chars) < length:
+        # One urandom call covers the password (~3% of bytes get rejected)
+        buf = os.urandom((length - len(chars)) * 2)
+        chars.extend(_PASSWORD_ALPHABET[b % len(_PASSWORD_ALPHABET)] for b in buf if b < _PASSWORD_BYTE_LIMIT)
+    return ''.join(chars[:length])
 
 
 def generate_access_token() -> str:
@@ -34,6 +64,10 @@ def generate_access_token() -> str:
     return secrets.token_hex(32)
 
 
+_ADMIN_TOKEN_LIFETIME = timedelta(minutes=settings.jwt_access_token_expire_minutes)
+_CLIENT_TOKEN_LIFETIME = timedelta(days=settings.jwt_refresh_token_expire_days)
+
+
 def create_access_token(
     data: dict,
     token_type: Literal["admin", "client"] = "admin",
@@ -41,38 +75,82 @@ def create_access_token(
 ) -> str:
     """Create JWT access token."""
     to_encode = data.copy()
+    now = datetime.now(timezone.utc)
 
     if expires_delta:
-        expire = datetime.now(timezone.utc) + expires_delta
+        expire = now + expires_delta
     else:
-        if token_type == "admin":
-            expire = datetime.now(timezone.utc) + timedelta(minutes=settings.jwt_access_token_expire_minutes)
-        else:
-            expire = datetime.now(timezone.utc) + timedelta(days=settings.jwt_refresh_token_expire_days)
+        expire = now + (_ADMIN_TOKEN_LIFETIME if token_type == "admin" else _CLIENT_TOKEN_LIFETIME)
 
     to_encode.update({
         "exp": expire,
         "type": token_type,
-        "iat": datetime.now(timezone.utc)
+        "iat": now
     })
 
     encoded_jwt = jwt.encode(to_encode, settings.secret_key, algorithm=settings.jwt_algorithm)
     return encoded_jwt
 
 
+# Verified payloads by token digest, until the token's own expiry
+TOKEN_CACHE_PRUNE_EVERY = 256
+_token_cache: Dict[bytes, Tuple[dict, float]] = {}
+_token_cache_inserts = 0
+
+
 def decode_token(token: str) -> Optional[dict]:
-    """Decode and validate JWT token."""
+    """Decode and validate JWT token (signature checked once per token)."""
+    global _token_cache_inserts
+    key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+    now = time.time()
+    cached = _token_cache.get(key)
+    if cached is not None:
+        if cached[1] > now:
+            return cached[0]
+        del _token_cache[key]
+
     try:
         payload = jwt.decode(token, settings.secret_key, algorithms=[settings.jwt_algorithm])
-        return payload
     except JWTError:
         return None
 
+    exp = payload.get("exp")
+    if isinstance(exp, (int, float)):
+        _token_cache[key] = (payload, exp)
+        _token_cache_inserts += 1
+        if _token_cache_inserts % TOKEN_CACHE_PRUNE_EVERY == 0:
+            for k in [k for k, (_, e) in _token_cache.items() if e <= now]:
+                del _token_cache[k]
+    return payload
+
+
+# Accepted 30s steps either side of the current one (pyotp's default is 0)
+TOTP_VALID_WINDOW = 0
+
+
+@lru_cache(maxsize=64)
+def _totp_key(secret: str) -> bytes:
+    """HMAC key of a base32 TOTP secret"""
+    return base64.b32decode(secret + "=" * (-len(secret) % 8), casefold=True)
+
+
+def _totp_code(key: bytes, counter: int) -> bytes:
+    """6-digit RFC 6238 code (SHA-1) for a time step"""
+    digest = hmac.new(key, struct.pack(">Q", counter), hashlib.sha1).digest()
+    offset = digest[-1] & 0x0F
+    value = struct.unpack_from(">I", digest, offset)[0] & 0x7FFFFFFF
+    return b"%06d" % (value % 1_000_000)
+
 
 def verify_totp(secret: str, code: str) -> bool:
-    """Verify TOTP code."""
-    totp = pyotp.TOTP(secret)
-    return totp.verify(code)
+    """Verify TOTP code (same result as pyotp.TOTP(secret).verify(code))."""
+    key = _totp_key(secret)
+    candidate = unicodedata.normalize("NFKC", code).encode()
+    counter = int(time.time()) // 30
+    return any(
+        hmac.compare_digest(_totp_code(key, counter + step), candidate)
+        for step in range(-TOTP_VALID_WINDOW, TOTP_VALID_WINDOW + 1)
+    )
 
 
 def generate_totp_secret() -> str:
@@ -88,6 +166,10 @@ def get_totp_uri(secret: str, username: str) -> str:
 
 def is_access_token_expired(client) -> bool:
     """Check if client's access token has expired. NULL = never expires."""
-    if client.access_token_expires_at is None:
+    expires_at = client.access_token_expires_at
+    if expires_at is None:
         return False
-    return datetime.now(timezone.utc) > client.access_token_expires_at.replace(tzinfo=timezone.utc)
+    # Loaded from the DB it's naive UTC: compare naive, without building a tz-aware copy
+    if expires_at.tzinfo is None:
+        return datetime.utcnow() > expires_at
+    return datetime.now(timezone.utc) > expires_at
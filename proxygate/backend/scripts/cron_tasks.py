@@ -7,6 +7,8 @@ Usage:
   python scripts/cron_tasks.py resolve_domains
   python scripts/cron_tasks.py collect_traffic_stats
   python scripts/cron_tasks.py backup
+  python scripts/cron_tasks.py monitor_proxy_auth
+  python scripts/cron_tasks.py run <task> [<task> ...]   (one process for several)
 
 Recommended crontab:
   */15 * * * * /opt/proxygate/venv/bin/python /opt/proxygate/backend/scripts/cron_tasks.py check_payments
@@ -18,8 +20,12 @@ Recommended crontab:
 import asyncio
 import sys
 import os
-import shutil
+import re
+import socket
+import sqlite3
 from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
 
 # Add parent directory to path
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -43,51 +49,68 @@ async def check_payments():
 
 async def resolve_domains():
     """Update domain -> IP mappings for all clients."""
-    from sqlalchemy import select
-    from sqlalchemy.orm import selectinload
+    from typing import Dict, Set
+    from sqlalchemy import select, update
     import json
 
     from app.database import async_session_maker
-    from app.models import Client
+    from app.models import Client, ClientDomain, VpnConfig
     from app.services.domain_resolver import DomainResolver
 
     print(f"[{datetime.now()}] Resolving domains...")
 
     resolver = DomainResolver()
-    updated = 0
 
     async with async_session_maker() as db:
-        result = await db.execute(
-            select(Client)
-            .options(
-                selectinload(Client.vpn_config),
-                selectinload(Client.domains)
-            )
+        vpn_config_ids: Dict[int, int] = dict((await db.execute(
+            select(VpnConfig.client_id, VpnConfig.id)
+            .join(Client, Client.id == VpnConfig.client_id)
             .where(Client.is_active == True)
+        )).all())
+
+        # Clients without any domain rows keep their cached routes. Domain
+        # rows are streamed in batches rather than fetched all at once.
+        domains_by_client: Dict[int, Set[str]] = {}
+        result = await db.stream(
+            select(ClientDomain.client_id, ClientDomain.domain, ClientDomain.is_active)
+            .join(Client, Client.id == ClientDomain.client_id)
+            .where(Client.is_active == True)
+            .execution_options(yield_per=1000)
         )
-        clients = result.scalars().all()
-
-        for client in clients:
-            if not client.vpn_config or not client.domains:
-                continue
-
-            # Resolve all active domains
-            active_domains = [d.domain for d in client.domains if d.is_active]
-            routes = resolver.resolve_domains(active_domains)
-
-            # Update cached routes
-            client.vpn_config.resolved_routes = json.dumps(routes)
-            client.vpn_config.last_resolved = datetime.utcnow()
-            updated += 1
-
+        async for client_id, domain, is_active in result:
+            if client_id in vpn_config_ids:
+                domains = domains_by_client.setdefault(client_id, set())
+                if is_active:
+                    domains.add(domain)
+
+        # Resolve every distinct domain once, then build each client's routes
+        # from the shared map; clients with the same domain set share the result
+        cidrs_by_domain = resolver.resolve_many(set().union(*domains_by_client.values()))
+        routes_by_domains: Dict[frozenset, str] = {}
+        now = datetime.utcnow()
+        rows = []
+
+        for client_id, domains in domains_by_client.items():
+            key = frozenset(domains)
+            routes = routes_by_domains.get(key)
+            if routes is None:
+                cidrs = set()
+                for domain in key:
+                    cidrs.update(cidrs_by_domain[domain])
+                routes = routes_by_domains[key] = json.dumps(resolver.optimize_routes(list(cidrs)))
+            rows.append({"id": vpn_config_ids[client_id], "resolved_routes": routes, "last_resolved": now})
+
+        # Update cached routes: one executemany UPDATE by primary key
+        if rows:
+            await db.execute(update(VpnConfig), rows)
         await db.commit()
 
-    print(f"Updated routes for {updated} clients")
+    print(f"Updated routes for {len(rows)} clients")
 
 
 async def collect_traffic_stats():
     """Collect WireGuard peer traffic statistics and update DB."""
-    from sqlalchemy import select
+    from sqlalchemy import bindparam, func, update
     from app.database import async_session_maker
     from app.models import WireguardConfig
     from app.services.wireguard_manager import WireGuardManager
@@ -105,28 +128,53 @@ async def collect_traffic_stats():
         print("No peer stats available")
         return
 
-    updated = 0
-    async with async_session_maker() as db:
-        result = await db.execute(
-            select(WireguardConfig).where(WireguardConfig.is_active == True)
+    # Driven straight from the stats: the DB finds each peer's row by its
+    # (indexed) public key, so no SELECT is needed first
+    rows = [
+        {
+            "pk": public_key,
+            "tx": peer_stat["tx"],
+            "rx": peer_stat["rx"],
+            "hs": datetime.utcfromtimestamp(peer_stat["last_handshake"]) if peer_stat["last_handshake"] else None,
+        }
+        for public_key, peer_stat in stats.items()
+    ]
+    wg_configs = WireguardConfig.__table__
+    stmt = (
+        update(wg_configs)
+        .where(wg_configs.c.public_key == bindparam("pk"), wg_configs.c.is_active == True)
+        .values(
+            traffic_up=bindparam("tx"),
+            traffic_down=bindparam("rx"),
+            # A peer that never completed a handshake keeps its previous one
+            last_handshake=func.coalesce(bindparam("hs"), wg_configs.c.last_handshake),
         )
-        configs = result.scalars().all()
+    )
+    async with async_session_maker() as db:
+        result = await db.execute(stmt, rows)
+        await db.commit()
 
-        for config in configs:
-            peer_stat = stats.get(config.public_key)
-            if peer_stat:
-                config.traffic_up = peer_stat["tx"]
-                config.traffic_down = peer_stat["rx"]
-                if peer_stat["last_handshake"]:
-                    config.last_handshake = datetime.utcfromtimestamp(peer_stat["last_handshake"])
-                updated += 1
+    # Some drivers (asyncpg) report no rowcount for executemany
+    if result.rowcount >= 0:
+        print(f"Updated traffic stats for {result.rowcount}/{len(stats)} peers")
+    else:
+        print(f"Updated traffic stats for {len(stats)} peers")
 
-        await db.commit()
 
-    print(f"Updated traffic stats for {updated}/{len(stats)} peers")
+def _sqlite_backup(db_path: str, backup_path: str):
+    """Copy db_path to backup_path with SQLite's online backup API."""
+    # A consistent snapshot taken under SQLite's locks, copied in steps
+    # so writers aren't held off for the whole file
+    src = sqlite3.connect(db_path)
+    dst = sqlite3.connect(backup_path)
+    try:
+        src.backup(dst, pages=1024, sleep=0.005)
+    finally:
+        dst.close()
+        src.close()
 
 
-def backup():
+async def backup():
     """Backup database file."""
     from app.config import settings
 
@@ -149,168 +197,256 @@ def backup():
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     backup_path = os.path.join(backup_dir, f"proxygate_{timestamp}.db")
 
-    shutil.copy2(db_path, backup_path)
+    # In a worker thread, so a combined run's event loop isn't stalled
+    await asyncio.to_thread(_sqlite_backup, db_path, backup_path)
     print(f"Backup created: {backup_path}")
 
-    # Clean old backups (keep last 30)
-    backups = sorted([
-        os.path.join(backup_dir, f) for f in os.listdir(backup_dir)
-        if f.endswith(".db")
-    ])
-    while len(backups) > 30:
-        os.remove(backups.pop(0))
-        print(f"Removed old backup")
+    # Clean old backups (keep last 30); names embed the timestamp, so name
+    # order is age order and no stat is needed
+    with os.scandir(backup_dir) as it:
+        backups = sorted((e for e in it if e.name.endswith(".db")), key=lambda e: e.name)
+    old = backups[:-30]
+    for entry in old:
+        os.unlink(entry.path)
+    if old:
+        print(f"Removed {len(old)} old backup(s)")
+
+
+# Attackers repeat: the same few source IPs fill most of a log tail
+@lru_cache(maxsize=65536)
+def _is_private_ipv4(ip: str) -> bool:
+    """Whether a dotted IPv4 address is in 10/8, 172.16/12, 192.168/16, 127/8 or 0/8."""
+    try:
+        n = int.from_bytes(socket.inet_aton(ip), 'big')
+    except OSError:
+        return False
+    first = n >> 24
+    return first == 10 or first == 127 or first == 0 or n >> 20 == 0xAC1 or n >> 16 == 0xC0A8
+
 
+# Kernel hash set of blocked proxy clients, matched by a single iptables rule
+BLOCKLIST_IPSET = "proxygate_blocklist"
 
-def _add_iptables_block(ip: str):
-    """Add iptables DROP rules for an IP on proxy ports (idempotent)."""
+
+def _add_ipset_blocks(ips):
+    """Add IPs to the proxy blocklist ipset, creating it and its DROP rule if needed."""
     import subprocess
-    for port in ("3128", "1080"):
-        # Check if rule already exists
-        check = subprocess.run(
-            ["iptables", "-C", "INPUT", "-s", ip, "-p", "tcp", "--dport", port, "-j", "DROP"],
-            capture_output=True
+    if not ips:
+        return
+    # One ipset run adds the whole batch; -exist makes it idempotent
+    payload = f"create {BLOCKLIST_IPSET} hash:ip\n" + "".join(
+        f"add {BLOCKLIST_IPSET} {ip}\n" for ip in ips
+    )
+    result = subprocess.run(
+        ["ipset", "restore", "-exist"], input=payload, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        print(f"  ipset restore failed: {result.stderr.strip()}")
+        return
+
+    rule = [
+        "INPUT", "-m", "set", "--match-set", BLOCKLIST_IPSET, "src",
+        "-p", "tcp", "-m", "multiport", "--dports", "3128,1080", "-j", "DROP"
+    ]
+    if subprocess.run(["iptables", "-C", *rule], capture_output=True).returncode != 0:
+        subprocess.run(["iptables", "-I", *rule], capture_output=True)
+    for ip in ips:
+        print(f"  ipset: blocked {ip}")
+
+    # Persist the set and its DROP rule; with ipset-persistent installed,
+    # netfilter-persistent restores the set at boot before the rules
+    try:
+        result = subprocess.run(
+            ["netfilter-persistent", "save"], capture_output=True, text=True
         )
-        if check.returncode != 0:
-            subprocess.run(
-                ["iptables", "-I", "INPUT", "-s", ip, "-p", "tcp", "--dport", port, "-j", "DROP"],
-                capture_output=True
-            )
-            print(f"  iptables: blocked {ip}:{port}")
+    except FileNotFoundError:
+        print("  netfilter-persistent not found, blocklist not saved")
+        return
+    if result.returncode != 0:
+        print(f"  netfilter-persistent save failed: {result.stderr.strip()}")
+
+
+PROXY_LOG_DIR = Path("/var/log/3proxy")
+MONITOR_STATE_FILE = PROXY_LOG_DIR / ".monitor_state"
+
+# Failed 3proxy auth: entries with 0.0.0.0:0 as destination and 0 0 bytes
+# Log format: date time username client_ip:port dest_ip:port bytes_out bytes_in request
+_FAILED_AUTH_MARKER = b' 0.0.0.0:0 0 0 '
+_FAILED_AUTH_RE = re.compile(
+    rb'[ \t]*\d{2}-\d{2}-\d{4} \d{2}:\d{2}:\d{2} (\S+) (\d+\.\d+\.\d+\.\d+):\d+ 0\.0\.0\.0:0 0 0 (.*\S)'
+)
+
+
+def _find_failed_auth(buf, start: int, end: int):
+    """
+    Yield (username, client_ip, request) bytes for failed auth lines in
+    buf[start:end]. Lines are located with a substring search for the
+    marker, so the regex only runs on candidate lines.
+    """
+    pos = start
+    while True:
+        hit = buf.find(_FAILED_AUTH_MARKER, pos, end)
+        if hit < 0:
+            return
+        line_start = max(buf.rfind(b'\n', start, hit) + 1, start)
+        line_end = buf.find(b'\n', hit, end)
+        if line_end < 0:
+            line_end = end
+        m = _FAILED_AUTH_RE.match(buf, line_start, line_end)
+        if m:
+            yield m.groups()
+        pos = line_end + 1
+
+
+def _load_monitor_state(state_file, log_file, st) -> int:
+    """
+    Return the processed position in the open log file, or 0 if the state
+    belongs to another file. State is keyed by (st_dev, st_ino), so a
+    rotated or recreated log is never mistaken for the one last read.
+    """
+    try:
+        parts = state_file.read_text().strip().split(":")
+        if len(parts) == 3:
+            dev, ino, pos = map(int, parts)
+            if (dev, ino) != (st.st_dev, st.st_ino):
+                return 0
+        elif len(parts) == 2 and parts[0] == str(log_file):
+            # Path-keyed state written before the inode was recorded
+            pos = int(parts[1])
+        else:
+            return 0
+    except (ValueError, OSError):
+        return 0
+    # Truncated in place (copytruncate): start over
+    return pos if pos <= st.st_size else 0
+
+
+def _save_monitor_state(state_file, st, pos: int):
+    """Atomically record how far the log has been processed."""
+    tmp_path = state_file.with_name(state_file.name + ".tmp")
+    with open(tmp_path, "w") as f:
+        f.write(f"{st.st_dev}:{st.st_ino}:{pos}")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, state_file)
 
 
 async def monitor_proxy_auth():
     """Parse 3proxy logs for failed auth attempts and record in security DB."""
-    import re
-    from pathlib import Path
+    import mmap
     from app.database import async_session_maker
     from app.services.security_service import SecurityService
 
-    LOG_DIR = Path("/var/log/3proxy")
-    STATE_FILE = LOG_DIR / ".monitor_state"
-
     # Find today's log file
     today = datetime.now().strftime("%Y.%m.%d")
-    log_file = LOG_DIR / f"3proxy.log.{today}"
+    log_file = PROXY_LOG_DIR / f"3proxy.log.{today}"
 
-    if not log_file.exists():
+    try:
+        f = open(log_file, 'rb')
+    except FileNotFoundError:
         print(f"[{datetime.now()}] No log file: {log_file}")
         return
 
-    # Read last processed position
-    last_pos = 0
-    last_file = ""
-    if STATE_FILE.exists():
-        try:
-            data = STATE_FILE.read_text().strip()
-            parts = data.rsplit(":", 1)
-            if len(parts) == 2:
-                last_file = parts[0]
-                last_pos = int(parts[1])
-        except (ValueError, IOError):
-            pass
-
-    # Reset position if log file changed (new day)
-    if last_file != str(log_file):
-        last_pos = 0
-
-    # Read new entries
-    with open(log_file) as f:
-        f.seek(last_pos)
-        new_lines = f.readlines()
-        new_pos = f.tell()
-
-    if not new_lines:
-        return
-
-    # Parse failed attempts: entries with 0.0.0.0:0 as destination
-    # Log format: date time username client_ip:port dest_ip:port bytes_out bytes_in request
-    # Failed: 0.0.0.0:0 and 0 0
-    failed_pattern = re.compile(
-        r'\d{2}-\d{2}-\d{4} \d{2}:\d{2}:\d{2} (\S+) (\d+\.\d+\.\d+\.\d+):\d+ 0\.0\.0\.0:0 0 0 (.+)'
-    )
-
-    # Skip local/private IPs
-    SKIP_IPS = {'127.0.0.1', '0.0.0.0', '::1'}
-
-    def _is_private(ip):
-        parts = ip.split('.')
-        if len(parts) != 4:
-            return True
-        first, second = int(parts[0]), int(parts[1])
-        return first == 10 or (first == 172 and 16 <= second <= 31) or (first == 192 and second == 168)
+    # Scan the new tail in place, without copying it out of the mapping
+    with f:
+        st = os.fstat(f.fileno())
+        last_pos = _load_monitor_state(MONITOR_STATE_FILE, log_file, st)
+        new_pos = st.st_size
+        if new_pos <= last_pos:
+            return
+        with mmap.mmap(f.fileno(), new_pos, access=mmap.ACCESS_READ) as mm:
+            matches = list(_find_failed_auth(mm, last_pos, new_pos))
 
     # Aggregate by IP
     failed_by_ip = {}
-    for line in new_lines:
-        line = line.strip()
-        if not line or "Accepting connections" in line or "Exiting thread" in line:
+    for username, client_ip, request in matches:
+        client_ip = client_ip.decode('ascii')
+        # Skip local/private IPs
+        if _is_private_ipv4(client_ip):
             continue
-        m = failed_pattern.match(line)
-        if m:
-            username, client_ip, request = m.groups()
-            if client_ip in SKIP_IPS or _is_private(client_ip):
-                continue
-            if username == '-':
-                username = None
-            if client_ip not in failed_by_ip:
-                failed_by_ip[client_ip] = []
-            failed_by_ip[client_ip].append({
-                'username': username,
-                'request': request,
-            })
+        username = None if username == b'-' else username.decode('utf-8', 'replace')
+        if client_ip not in failed_by_ip:
+            failed_by_ip[client_ip] = []
+        failed_by_ip[client_ip].append({
+            'username': username,
+            'request': request.decode('utf-8', 'replace'),
+        })
 
     if not failed_by_ip:
         # Save position even if no failed attempts
-        STATE_FILE.write_text(f"{log_file}:{new_pos}")
+        _save_monitor_state(MONITOR_STATE_FILE, st, new_pos)
         return
 
     total_attempts = sum(len(v) for v in failed_by_ip.values())
     print(f"[{datetime.now()}] Found {total_attempts} failed proxy auth attempts from {len(failed_by_ip)} IPs")
 
+    # Record up to 10 individual attempts per IP (avoid flooding DB),
+    # all in one batch
+    rows = [
+        {
+            "ip_address": ip,
+            "username": attempt['username'],
+            "endpoint": "3proxy",
+            "user_agent": attempt['request'][:255] if attempt['request'] else None,
+        }
+        for ip, attempts in failed_by_ip.items()
+        for attempt in attempts[:10]
+    ]
     async with async_session_maker() as db:
-        svc = SecurityService(db)
-        for ip, attempts in failed_by_ip.items():
-            # Record up to 10 individual attempts per IP (avoid flooding DB)
-            for attempt in attempts[:10]:
-                blocked = await svc.record_failed_attempt(
-                    ip_address=ip,
-                    username=attempt['username'],
-                    endpoint="3proxy",
-                    user_agent=attempt['request'][:255] if attempt['request'] else None
-                )
-                if blocked:
-                    print(f"  Blocked IP: {ip} ({blocked.reason})")
-                    # Add iptables rule (only once per IP)
-                    _add_iptables_block(ip)
-                    break  # Stop recording more attempts for this IP
-
-            if len(attempts) > 10:
-                print(f"  IP {ip}: {len(attempts)} attempts (recorded first 10)")
-
-    # Save position
-    STATE_FILE.write_text(f"{log_file}:{new_pos}")
+        blocks = await SecurityService(db).record_failed_attempts(rows)
+
+    # Save position as soon as the attempts are committed, so a failure
+    # below doesn't get them recorded twice
+    _save_monitor_state(MONITOR_STATE_FILE, st, new_pos)
+
+    for ip, attempts in failed_by_ip.items():
+        blocked = blocks.get(ip)
+        if blocked:
+            print(f"  Blocked IP: {ip} ({blocked.reason})")
+        if len(attempts) > 10:
+            print(f"  IP {ip}: {len(attempts)} attempts (recorded first 10)")
+
+    # Drop proxy traffic from all newly blocked IPs at once
+    _add_ipset_blocks(blocks)
     print(f"Proxy auth monitoring complete")
 
 
+TASKS = {
+    "check_payments": check_payments,
+    "resolve_domains": resolve_domains,
+    "collect_traffic_stats": collect_traffic_stats,
+    "backup": backup,
+    "monitor_proxy_auth": monitor_proxy_auth,
+}
+
+
+async def run_many(tasks):
+    """
+    Run several tasks in one process and event loop, so they share the
+    imports and the DB engine. Tasks run one after another: on SQLite,
+    concurrent writers would only wait on each other's locks.
+    """
+    for task in tasks:
+        await TASKS[task]()
+
+
 def main():
     if len(sys.argv) < 2:
-        print("Usage: python cron_tasks.py <task>")
-        print("Tasks: check_payments, resolve_domains, collect_traffic_stats, backup, monitor_proxy_auth")
+        print("Usage: python cron_tasks.py <task> | run <task> [<task> ...]")
+        print(f"Tasks: {', '.join(TASKS)}")
         sys.exit(1)
 
     task = sys.argv[1]
 
-    if task == "check_payments":
-        asyncio.run(check_payments())
-    elif task == "resolve_domains":
-        asyncio.run(resolve_domains())
-    elif task == "collect_traffic_stats":
-        asyncio.run(collect_traffic_stats())
-    elif task == "monitor_proxy_auth":
-        asyncio.run(monitor_proxy_auth())
-    elif task == "backup":
-        backup()
+    if task == "run":
+        tasks = sys.argv[2:]
+        unknown = [t for t in tasks if t not in TASKS]
+        if not tasks or unknown:
+            print(f"Unknown task: {', '.join(unknown)}" if unknown else "No tasks given")
+            sys.exit(1)
+        asyncio.run(run_many(tasks))
+    elif task in TASKS:
+        asyncio.run(TASKS[task]())
     else:
         print(f"Unknown task: {task}")
         sys.exit(1)
@@ -14,7 +14,7 @@ import json
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import insert, select
 
 from app.database import async_session_maker, init_db
 from app.models import AdminUser, DomainTemplate
@@ -115,6 +115,19 @@ INITIAL_TEMPLATES = [
 ]
 
 
+# DomainTemplate rows for INITIAL_TEMPLATES
+_TEMPLATE_ROWS = [
+    {
+        "name": t["name"],
+        "icon": t["icon"],
+        "description": t["description"],
+        "domains_json": json.dumps(t["domains"]),
+        "is_active": True,
+    }
+    for t in INITIAL_TEMPLATES
+]
+
+
 async def create_admin_user(db: AsyncSession) -> None:
     """Create initial admin user."""
     # Check if admin exists
@@ -139,27 +152,22 @@ async def create_admin_user(db: AsyncSession) -> None:
 
 async def create_domain_templates(db: AsyncSession) -> None:
     """Create initial domain templates."""
-    for template_data in INITIAL_TEMPLATES:
-        # Check if template exists
-        result = await db.execute(
-            select(DomainTemplate).where(DomainTemplate.name == template_data["name"])
-        )
-        existing = result.scalar_one_or_none()
-
-        if existing:
-            print(f"Template '{template_data['name']}' already exists")
-            continue
-
-        template = DomainTemplate(
-            name=template_data["name"],
-            icon=template_data["icon"],
-            description=template_data["description"],
-            domains_json=json.dumps(template_data["domains"]),
-            is_active=True
-        )
-        db.add(template)
-        print(f"Created template: {template_data['name']}")
-
+    # One query for the templates that already exist, one INSERT for the rest
+    result = await db.execute(
+        select(DomainTemplate.name).where(DomainTemplate.name.in_([r["name"] for r in _TEMPLATE_ROWS]))
+    )
+    existing = set(result.scalars())
+
+    to_insert = []
+    for row in _TEMPLATE_ROWS:
+        if row["name"] in existing:
+            print(f"Template '{row['name']}' already exists")
+        else:
+            to_insert.append(row)
+            print(f"Created template: {row['name']}")
+
+    if to_insert:
+        await db.execute(insert(DomainTemplate), to_insert)
     await db.commit()
 
 
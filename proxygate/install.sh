@@ -390,6 +390,7 @@ install_base_packages() {
         openssl \
         cron \
         iptables \
+        ipset \
         jq
 
     log_success "Базовые пакеты установлены"
@@ -1312,6 +1313,10 @@ setup_iptables() {
 
     # Устанавливаем iptables-persistent для автозагрузки
     apt-get install -y iptables-persistent 2>/dev/null || true
+    # Плагин netfilter-persistent для ipset: cron сохраняет proxygate_blocklist
+    # через "netfilter-persistent save", при загрузке set восстанавливается
+    # раньше правил, которые на него ссылаются
+    apt-get install -y ipset-persistent 2>/dev/null || true
 
     log_success "iptables PROXYGATE chain настроен"
 }